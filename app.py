@@ -1,10 +1,29 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
+import plotly.graph_objects as go
 import os
 import glob
 import json
-from screening_utils import configure_genai, screen_patient
+import ast
+import asyncio
+import shutil
+import time
+from urllib.parse import unquote
+import orjson
+import pyarrow as pa
+import pyarrow.dataset as ds
+from screening_utils import (
+    configure_genai,
+    screen_patient,
+    screen_patient_async,
+    deterministic_exclusion,
+    use_result_cache_file,
+    PREGNANCY_RE,
+    batch_screen_patients,
+    get_batch_state,
+    collect_batch_results,
+    BATCH_FINAL_STATES,
+)
 
 # Set page config
 st.set_page_config(layout="wide", page_title="Clinical Trial Screener", page_icon="🏥")
@@ -69,6 +88,237 @@ else:
     # No key found in env or secrets
     pass
 
+# --- HELPERS ---
+DATA_DIR = 'screening_results'  # Parquet dataset, one trial_name=<name>/ partition per trial
+LEGACY_DATA_FILES = ['screening_results.parquet', 'screening_results.csv']  # Read (and migrated) until the first save
+PATIENT_FILE = 'patients_for_trial_screening.csv'
+PATIENT_DTYPES = {'patient_id': str, 'age': 'Int16', 'gender': 'category', 'hba1c': 'float64', 'egfr': 'float64', 'insulin_user': 'boolean'}
+PATIENT_TEXT_COLUMNS = {'current_medications', 'comorbidities', 'diagnoses'}
+PENDING_BATCH_FILE = 'pending_batch.json'
+BATCH_JOURNAL_FILE = 'results_batch.jsonl'  # Append-only log of an in-progress real-time batch
+TRIALS_INDEX_FILE = 'trials_index.json'  # Trial names present in the results, for the sidebar
+SCREEN_CACHE_FILE = 'screen_cache.jsonl'  # Append-only log of model results by content hash; survives restarts
+
+# Back screen_patient's result cache with the file (loaded once per process, a no-op on reruns)
+use_result_cache_file(SCREEN_CACHE_FILE)
+
+DECISION_COLORS = {'ELIGIBLE': '#22c55e', 'INELIGIBLE': '#ef4444', 'UNCERTAIN': '#f97316', 'ERROR': '#64748b'}
+
+LIST_COLUMNS = ['missing_info', 'inclusion_criteria_not_met', 'exclusion_criteria_met']
+# Read schema for the dataset: part files written with all-empty lists (or by the CLI) are cast to it
+RESULTS_SCHEMA = pa.schema([(c, pa.string()) for c in ['patient_id', 'trial_name', 'decision', 'reason']] +
+                           [(c, pa.list_(pa.string())) for c in LIST_COLUMNS])
+RESULTS_PARTITIONING = ds.partitioning(pa.schema([('trial_name', pa.string())]), flavor='hive')  # Keep names like "2024" as strings
+
+def _as_list(value):
+    """Coerce a list cell (list, Parquet array, legacy string or NaN) to a list of strings."""
+    if isinstance(value, str):
+        v = value.strip()
+        if v.startswith('['):
+            # JSON, or str(list) written by older versions
+            try:
+                return [str(x) for x in orjson.loads(v)]
+            except orjson.JSONDecodeError:
+                try:
+                    return [str(x) for x in ast.literal_eval(v)]
+                except (ValueError, SyntaxError):
+                    pass
+        return [x for x in map(str.strip, v.split(';')) if x]
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return []
+    return [str(x) for x in value]
+
+def patient_records(df):
+    """Rows of a patient table as dicts; a blank or missing patient_id becomes BATCH_{i} (its row
+    position, as in batch_screen_patients), so such patients keep distinct results."""
+    records = df.to_dict(orient="records")
+    for i, rec in enumerate(records):
+        pid = rec.get("patient_id")
+        if pid is None or pd.isna(pid) or not str(pid).strip():
+            rec["patient_id"] = f"BATCH_{i}"
+    return records
+
+def _result_row(patient_id, trial_name, res):
+    """Flatten a screening result into a row of the results file."""
+    return {
+        "patient_id": str(patient_id),
+        "trial_name": trial_name,
+        "decision": res.get("decision", "ERROR"),
+        "reason": res.get("reason", ""),
+        "missing_info": _as_list(res.get("missing_info")),
+        "inclusion_criteria_not_met": _as_list(res.get("inclusion_criteria_not_met")),
+        "exclusion_criteria_met": _as_list(res.get("exclusion_criteria_met"))
+    }
+
+def run_screening(records, trial_text, trial_name, concurrency, on_row, force_refresh=False):
+    """
+    Screen patient records against one protocol, calling on_row(row) as each one finishes
+    (row is None if the call raised). Rule-excluded patients are reported first without a
+    model call; the rest go to Gemini with at most `concurrency` requests in flight.
+    Returns the number of model calls saved by deterministic rules.
+    """
+    llm_records = []
+    for rec in records:
+        res = deterministic_exclusion(rec, trial_text)
+        if res:
+            on_row(_result_row(rec.get("patient_id", ""), trial_name, res))
+        else:
+            llm_records.append(rec)
+
+    async def _screen_all():
+        sem = asyncio.Semaphore(concurrency)
+
+        async def _one(rec):
+            async with sem:
+                res = await screen_patient_async(rec, trial_text, force_refresh=force_refresh)
+            return _result_row(rec.get("patient_id", ""), trial_name, res)
+
+        for fut in asyncio.as_completed([_one(rec) for rec in llm_records]):
+            try:
+                row = await fut
+            except Exception:
+                row = None
+            on_row(row)
+
+    asyncio.run(_screen_all())
+    return len(records) - len(llm_records)
+
+def read_results(columns=None):
+    """Load the results table, falling back to the legacy files. Returns None if nothing exists."""
+    if os.path.isdir(DATA_DIR):
+        key_cols = ['patient_id', 'trial_name']
+        read_cols = None if columns is None else list(dict.fromkeys(key_cols + columns))
+        df = pd.read_parquet(DATA_DIR, columns=read_cols, partitioning=RESULTS_PARTITIONING, schema=RESULTS_SCHEMA)
+        # Saves append part files (named by write time); the latest row per patient and trial wins
+        df = df.drop_duplicates(key_cols, keep='last', ignore_index=True)
+        return df if columns is None else df[columns]
+    legacy_parquet, legacy_csv = LEGACY_DATA_FILES
+    if os.path.exists(legacy_parquet):
+        return pd.read_parquet(legacy_parquet, columns=columns)
+    if os.path.exists(legacy_csv):
+        df = pd.read_csv(legacy_csv, usecols=columns, dtype={'patient_id': str}, engine='pyarrow')
+        # Parquet stores list columns natively; convert the CSV's string cells
+        for col in LIST_COLUMNS:
+            if columns is None or col in columns:
+                df[col] = df[col].map(_as_list) if col in df else [[] for _ in range(len(df))]
+        return df
+    return None
+
+def _mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+def results_mtime():
+    """Change marker for the results; save_results touches DATA_DIR after every write."""
+    for path in [DATA_DIR] + LEGACY_DATA_FILES:
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            continue
+    return 0
+
+def _trial_partitions():
+    """Trial name -> partition directory of the results dataset."""
+    if not os.path.isdir(DATA_DIR):
+        return {}
+    return {unquote(d.split('=', 1)[1]): os.path.join(DATA_DIR, d)
+            for d in os.listdir(DATA_DIR) if d.startswith('trial_name=')}
+
+def _append_results(df):
+    df.to_parquet(DATA_DIR, partition_cols=['trial_name'], compression='zstd', index=False,
+                  basename_template=f"part-{time.time_ns()}-{{i}}.parquet")
+
+def save_results(df_res, replace_trial=None):
+    """Append `df_res` to the results dataset; newer rows supersede older ones for the same patient and trial.
+
+    With `replace_trial`, that trial's earlier results are dropped first (a full re-run).
+    Only the new rows are written, so the cost no longer grows with the stored history.
+    """
+    if df_res.empty:
+        return
+    if not os.path.isdir(DATA_DIR):
+        # One-time migration of the single-file results (read_results keeps the last row per
+        # patient and trial, so legacy duplicates are dropped here)
+        legacy = read_results()
+        if legacy is not None and not legacy.empty:
+            _append_results(legacy)
+    if replace_trial is not None and replace_trial in _trial_partitions():
+        shutil.rmtree(_trial_partitions()[replace_trial])
+    _append_results(df_res)
+    os.utime(DATA_DIR)
+
+def write_trials_index(df):
+    with open(TRIALS_INDEX_FILE, 'w') as f: json.dump(sorted(df['trial_name'].dropna().unique().tolist()), f)
+
+@st.cache_data
+def _read_trials_index(index_mtime):
+    with open(TRIALS_INDEX_FILE, 'r') as f: return json.load(f)
+
+def screened_trials():
+    """Trial names in the results, read from the sidecar index instead of the full table."""
+    if os.path.isdir(DATA_DIR):
+        # Partition directories are the trial names; no need to open any data file
+        return sorted(_trial_partitions())
+
+    index_mtime = _mtime_ns(TRIALS_INDEX_FILE)
+    # Legacy single-file results: rebuild when missing or older than the file
+    if index_mtime == 0 or index_mtime < results_mtime():
+        df = read_results(columns=['trial_name'])
+        if df is None:
+            return []
+        write_trials_index(df)
+        index_mtime = _mtime_ns(TRIALS_INDEX_FILE)
+    return _read_trials_index(index_mtime)
+
+@st.cache_data
+def list_trials(dir_mtime):
+    """Protocol files and names; keyed on the trials dir mtime so reruns cost a single stat()."""
+    files = sorted(glob.glob(os.path.join('trials', "*.md")))
+    return files, [os.path.basename(t).replace('.md', '') for t in files]
+
+@st.cache_data
+def read_trial(path, mtime):
+    """Protocol text, re-read only when the file changes."""
+    with open(path, 'r') as f: return f.read()
+
+def load_trial_text(path):
+    return read_trial(path, os.path.getmtime(path))
+
+def read_journal():
+    """Rows written by an unfinished real-time batch run (empty frame if none)."""
+    if not os.path.exists(BATCH_JOURNAL_FILE) or os.path.getsize(BATCH_JOURNAL_FILE) == 0:
+        return pd.DataFrame()
+    rows = []
+    with open(BATCH_JOURNAL_FILE, 'rb') as f:
+        for line in f:
+            try:
+                rows.append(orjson.loads(line))
+            except orjson.JSONDecodeError:
+                continue  # Torn last line from a crash mid-write
+    # Rows are already flat (lists stay lists), so one constructor call builds the frame
+    df = pd.DataFrame.from_records(rows)
+    if 'patient_id' in df:
+        df['patient_id'] = df['patient_id'].astype(str)
+    return df
+
+def load_pending_batch():
+    """Batch job awaiting results, kept on disk so a browser refresh doesn't lose it."""
+    if "pending_batch" not in st.session_state:
+        pending = None
+        if os.path.exists(PENDING_BATCH_FILE):
+            with open(PENDING_BATCH_FILE, 'r') as f: pending = json.load(f)
+        st.session_state['pending_batch'] = pending
+    return st.session_state['pending_batch']
+
+def set_pending_batch(pending):
+    st.session_state['pending_batch'] = pending
+    if pending:
+        with open(PENDING_BATCH_FILE, 'w') as f: json.dump(pending, f)
+    elif os.path.exists(PENDING_BATCH_FILE):
+        os.remove(PENDING_BATCH_FILE)
+
 # --- SIDEBAR ---
 with st.sidebar:
     st.markdown("## 🏥 ClinicalDSS")
@@ -77,19 +327,11 @@ with st.sidebar:
 
     st.markdown("### ⚙️ Controls")
     
-    DATA_FILE = 'screening_results.csv'
-    PATIENT_FILE = 'patients_for_trial_screening.csv'
-
     # Load Trial Files
-    trial_files_all = glob.glob(os.path.join('trials', "*.md"))
-    trial_names_files = [os.path.basename(t).replace('.md', '') for t in trial_files_all]
+    trial_files, trial_names = list_trials(os.path.getmtime('trials'))
 
     # Pre-loading data for sidebar filter usage
-    trials_list = trial_names_files.copy()
-    if os.path.exists(DATA_FILE):
-             df_temp = pd.read_csv(DATA_FILE)
-             existing_trials = df_temp['trial_name'].unique().tolist()
-             trials_list = list(set(trials_list + existing_trials))
+    trials_list = list(set(trial_names + screened_trials()))
     
     # Sort list
     trials_list.sort()
@@ -100,8 +342,14 @@ with st.sidebar:
     with col_refresh:
         if st.button("🔄", help="Refresh List"):
             st.cache_data.clear()
+            st.session_state.pop('df_mtime', None)
+            st.session_state.pop('pat_mtime', None)
             st.rerun()
 
+    # Concurrent Gemini calls for batch screening (lower if hitting RPM limits)
+    max_concurrency = st.slider("Parallel Requests", 1, 32, 16, help="Concurrent Gemini calls during batch screening. Lower this if you hit rate limits.")
+    force_refresh = st.checkbox("Ignore cached results", help="Re-screen patients even if this exact record and protocol were screened before.")
+
     st.markdown("---")
     st.caption(f"v1.0.5 • Found {len(trials_list)} protocols")
 
@@ -117,38 +365,91 @@ tab1, tab2, tab3, tab4 = st.tabs(["📊 Data Overview", "🩺 Patient Screening"
 # --- TAB 1: DASHBOARD ---
 with tab1:
     @st.cache_data
-    def load_data(file_mtime):
-        if os.path.exists(DATA_FILE):
-             df_res = pd.read_csv(DATA_FILE)
-        else:
+    def load_results(file_mtime):
+        """Results frame plus per-trial / per-patient groups; invalidated only when the results change."""
+        df_res = read_results()
+        if df_res is None:
              df_res = pd.DataFrame(columns=["patient_id", "trial_name", "decision", "reason", "missing_info"])
 
-        if os.path.exists(PATIENT_FILE):
-            df_pat = pd.read_csv(PATIENT_FILE)
-            df_pat['patient_id'] = df_pat['patient_id'].astype(str)
-            df_res['patient_id'] = df_res['patient_id'].astype(str)
+        # Small fixed vocabulary: categorical codes instead of repeated strings
+        df_res['decision'] = df_res['decision'].astype(
+            pd.CategoricalDtype(categories=['ELIGIBLE', 'INELIGIBLE', 'UNCERTAIN', 'ERROR']))
+
+        # Categorical IDs: the deduplicated ID list is kept as the categories
+        df_res['patient_id'] = df_res['patient_id'].astype('category')
+
+        # Pre-split results so trial / patient selection is a dict lookup per rerun
+        by_trial = {name: g for name, g in df_res.groupby('trial_name', sort=False)}
+        by_patient = {pid: g for pid, g in df_res.groupby('patient_id', sort=False, observed=True)}
+
+        return df_res, by_trial, by_patient
+
+    @st.cache_data
+    def load_patients(patient_mtime):
+        """Patient profiles indexed by ID; invalidated only when the patient file changes."""
+        if patient_mtime:  # 0 when the file does not exist
+            # Only the profile columns, with explicit dtypes (patient_id read as text directly).
+            # The pyarrow engine needs a column list, so take it from the header first.
+            header = pd.read_csv(PATIENT_FILE, nrows=0).columns
+            df_pat = pd.read_csv(PATIENT_FILE, usecols=[c for c in header if c in PATIENT_DTYPES or c in PATIENT_TEXT_COLUMNS],
+                                 dtype=PATIENT_DTYPES, engine='pyarrow')
+
+            # Pregnancy flag, computed once per load instead of per selection
+            empty = pd.Series('', index=df_pat.index)
+            diag_full = (df_pat.get('comorbidities', empty).fillna('').astype(str) + " " +
+                         df_pat.get('diagnoses', empty).fillna('').astype(str))
+            df_pat['is_pregnant'] = diag_full.str.contains(PREGNANCY_RE, na=False)
+
+            # Index by ID so profile lookups are a hash hit, not a boolean scan
+            df_pat = df_pat.drop_duplicates('patient_id').set_index('patient_id', drop=False)
         else:
             df_pat = pd.DataFrame()
+        return df_pat
 
-        return df_res, df_pat
+    @st.cache_data
+    def decision_counts(file_mtime, trial):
+        """Screened total and per-decision counts in a single pass over the column."""
+        df_res, by_trial, _ = load_results(file_mtime)
+        if trial != "All Protocols":
+            df_res = by_trial.get(trial, df_res.iloc[:0])
+        return len(df_res), df_res['decision'].value_counts().to_dict()
 
-    file_mtime = os.path.getmtime(DATA_FILE) if os.path.exists(DATA_FILE) else 0
-    df, df_patients = load_data(file_mtime)
+    @st.cache_data
+    def patient_choices(file_mtime, trial):
+        """Patient IDs with results under the trial filter, for the 360° selectbox."""
+        df_res, by_trial, _ = load_results(file_mtime)
+        if trial != "All Protocols":
+            df_res = by_trial.get(trial, df_res.iloc[:0])
+        return df_res['patient_id'].cat.remove_unused_categories().cat.categories.tolist()
+
+    # One stat() per file per rerun; integer ns avoids float-key quirks for same-second writes
+    file_mtime = results_mtime()
+    patient_mtime = _mtime_ns(PATIENT_FILE)
+    # Keep the working frames in session state; only go back to the cache for the file that changed
+    if st.session_state.get('df_mtime') != file_mtime:
+        st.session_state['results_data'] = load_results(file_mtime)
+        st.session_state['df_mtime'] = file_mtime
+    if st.session_state.get('pat_mtime') != patient_mtime:
+        st.session_state['patients_data'] = load_patients(patient_mtime)
+        st.session_state['pat_mtime'] = patient_mtime
+    df, by_trial, by_patient = st.session_state['results_data']
+    df_patients = st.session_state['patients_data']
 
     if df.empty:
         st.info("Waiting for data pipeline...")
     else:
         if selected_filter_trial != "All Protocols":
-            filtered_df = df[df['trial_name'] == selected_filter_trial]
+            filtered_df = by_trial.get(selected_filter_trial, df.iloc[:0])
         else:
             filtered_df = df
 
         # KPI CARDS
+        n_screened, counts = decision_counts(file_mtime, selected_filter_trial)
         c1, c2, c3, c4 = st.columns(4)
-        c1.metric("Screened", len(filtered_df), delta="Patients")
-        c2.metric("Eligible", len(filtered_df[filtered_df['decision'] == 'ELIGIBLE']), delta_color="normal")
-        c3.metric("Ineligible", len(filtered_df[filtered_df['decision'] == 'INELIGIBLE']), delta_color="inverse")
-        c4.metric("Uncertain", len(filtered_df[filtered_df['decision'] == 'UNCERTAIN']), delta_color="off")
+        c1.metric("Screened", n_screened, delta="Patients")
+        c2.metric("Eligible", counts.get('ELIGIBLE', 0), delta_color="normal")
+        c3.metric("Ineligible", counts.get('INELIGIBLE', 0), delta_color="inverse")
+        c4.metric("Uncertain", counts.get('UNCERTAIN', 0), delta_color="off")
 
         st.markdown("<br>", unsafe_allow_html=True)
 
@@ -157,82 +458,89 @@ with tab1:
 
         with c_chart:
             st.markdown("##### 📈 Eligibility Distribution")
-            fig_pie = px.pie(filtered_df, names='decision', color='decision',
-                            color_discrete_map={'ELIGIBLE':'#22c55e', 'INELIGIBLE':'#ef4444', 'UNCERTAIN':'#f97316', 'ERROR':'#64748b'},
-                            hole=0.6)
-            fig_pie.update_layout(showlegend=False, margin=dict(t=0, b=0, l=0, r=0), height=250)
-            st.plotly_chart(fig_pie, use_container_width=True)
+            # Built from the cached counts: a handful of slices instead of one row per result
+            labels = [d for d in DECISION_COLORS if counts.get(d)]
+            fig_pie = go.Figure(go.Pie(labels=labels, values=[counts[d] for d in labels], hole=0.6,
+                                       marker_colors=[DECISION_COLORS[d] for d in labels]))
+            fig_pie.update_layout(showlegend=False, margin=dict(t=0, b=0, l=0, r=0), height=250, transition_duration=0)
+            # Stable keys let the front end update the existing chart/table instead of remounting them
+            st.plotly_chart(fig_pie, use_container_width=True, key="pie_main")
 
         with c_table:
             st.markdown("##### 📋 Recent Decisions")
-            display_df = filtered_df[['patient_id', 'trial_name', 'decision']].copy()
-            st.dataframe(display_df, height=250, use_container_width=True, hide_index=True)
+            st.dataframe(filtered_df[['patient_id', 'trial_name', 'decision']], height=250, use_container_width=True, hide_index=True, key="table_main")
 
 
         # --- PATIENT SNAPSHOT ---
         st.markdown("---")
         st.markdown("### 🧑‍⚕️ Patient 360° View")
 
-        patient_ids = filtered_df['patient_id'].unique()
-        selected_patient = st.selectbox("Search Patient ID", patient_ids)
+        # Fragment: picking a patient reruns only this block, not the whole page
+        @st.fragment
+        def patient_view(file_mtime, filtered_df, df_patients, by_patient, selected_filter_trial):
+            patient_ids = patient_choices(file_mtime, selected_filter_trial)
+            selected_patient = st.selectbox("Search Patient ID", patient_ids)
 
-        if selected_patient:
-            c_profile, c_analysis = st.columns([1, 2])
+            if selected_patient:
+                c_profile, c_analysis = st.columns([1, 2])
 
-            with c_profile:
-                st.markdown("""<div style="background: white; padding: 20px; border-radius: 12px; border: 1px solid #e2e8f0;">
-                                <h4 style="margin-top:0;">📋 Clinical Profile</h4>""", unsafe_allow_html=True)
+                with c_profile:
+                    st.markdown("""<div style="background: white; padding: 20px; border-radius: 12px; border: 1px solid #e2e8f0;">
+                                    <h4 style="margin-top:0;">📋 Clinical Profile</h4>""", unsafe_allow_html=True)
 
-                if not df_patients.empty and selected_patient in df_patients['patient_id'].values:
-                    pat_row = df_patients[df_patients['patient_id'] == selected_patient].iloc[0]
+                    if not df_patients.empty and selected_patient in df_patients.index:
+                        pat_row = df_patients.loc[selected_patient]
 
-                    st.markdown(f"""
-                    **Age:** {pat_row['age']} &nbsp; • &nbsp; **Gender:** {pat_row['gender']}<br>
-                    **HbA1c:** {pat_row['hba1c']}% &nbsp; • &nbsp; **eGFR:** {pat_row['egfr']}<br>
-                    **Insulin:** {'✅' if str(pat_row['insulin_user']).lower()=='true' else '❌'}
-                    <hr style="margin: 10px 0;">
-                    """, unsafe_allow_html=True)
+                        st.markdown(f"""
+                        **Age:** {pat_row['age']} &nbsp; • &nbsp; **Gender:** {pat_row['gender']}<br>
+                        **HbA1c:** {pat_row['hba1c']}% &nbsp; • &nbsp; **eGFR:** {pat_row['egfr']}<br>
+                        **Insulin:** {'✅' if str(pat_row['insulin_user']).lower()=='true' else '❌'}
+                        <hr style="margin: 10px 0;">
+                        """, unsafe_allow_html=True)
 
-                    st.markdown("**💊 Medications**")
-                    st.caption(str(pat_row['current_medications']).replace(';', ', '))
+                        st.markdown("**💊 Medications**")
+                        st.caption(str(pat_row['current_medications']).replace(';', ', '))
 
-                    # Pregnancy Check
-                    diag_full = (str(pat_row.get('comorbidities', '')) + " " + str(pat_row.get('diagnoses', ''))).lower()
-                    is_pregnant = any(x in diag_full for x in ['pregn', 'gestat'])
+                        st.markdown("**🤰 Pregnancy Status**")
+                        if pat_row['is_pregnant']:
+                            st.error("⚠️ DETECTED (Exclusion Risk)")
+                        else:
+                            st.caption("✅ Not Detected")
 
-                    st.markdown("**🤰 Pregnancy Status**")
-                    if is_pregnant:
-                        st.error("⚠️ DETECTED (Exclusion Risk)")
+                        st.markdown("**🩺 Comorbidities**")
+                        st.caption(str(pat_row['comorbidities']).replace(';', ', '))
                     else:
-                        st.caption("✅ Not Detected")
-
-                    st.markdown("**🩺 Comorbidities**")
-                    st.caption(str(pat_row['comorbidities']).replace(';', ', '))
-                else:
-                    st.warning("Data not found.")
-                st.markdown("</div>", unsafe_allow_html=True)
-
-            with c_analysis:
-                st.markdown("#### 🤖 AI Screening Analysis")
-                pat_data = filtered_df[filtered_df['patient_id'] == selected_patient]
-
-                for i, row in pat_data.iterrows():
-                    dec = row['decision']
-                    color = "#22c55e" if dec == "ELIGIBLE" else "#ef4444" if dec == "INELIGIBLE" else "#f97316"
-                    icon = "✅" if dec == "ELIGIBLE" else "🚫" if dec == "INELIGIBLE" else "⚠️"
-
-                    with st.expander(f"{icon} {row['trial_name']}", expanded=True):
-                        st.markdown(f"<h3 style='color: {color}; margin:0;'>{dec}</h3>", unsafe_allow_html=True)
-                        st.info(f"**Summary**: {row.get('reason')}")
+                        st.warning("Data not found.")
+                    st.markdown("</div>", unsafe_allow_html=True)
+
+                with c_analysis:
+                    st.markdown("#### 🤖 AI Screening Analysis")
+                    pat_data = by_patient.get(selected_patient, filtered_df.iloc[:0])
+                    if selected_filter_trial != "All Protocols":
+                        pat_data = pat_data[pat_data['trial_name'] == selected_filter_trial]
+
+                    for row in pat_data.to_dict(orient="records"):
+                        dec = row['decision']
+                        color = "#22c55e" if dec == "ELIGIBLE" else "#ef4444" if dec == "INELIGIBLE" else "#f97316"
+                        icon = "✅" if dec == "ELIGIBLE" else "🚫" if dec == "INELIGIBLE" else "⚠️"
+
+                        with st.expander(f"{icon} {row['trial_name']}", expanded=True):
+                            st.markdown(f"<h3 style='color: {color}; margin:0;'>{dec}</h3>", unsafe_allow_html=True)
+                            st.info(f"**Summary**: {row.get('reason')}")
                         
-                        # Show Detailed Lists if available
-                        if row.get('inclusion_criteria_not_met') and row.get('inclusion_criteria_not_met') != "[]":
-                             st.error(f"❌ Unmet Inclusions: {row.get('inclusion_criteria_not_met')}")
-                        if row.get('exclusion_criteria_met') and row.get('exclusion_criteria_met') != "[]":
-                             st.error(f"⛔ Met Exclusions: {row.get('exclusion_criteria_met')}")
+                            # Show Detailed Lists if available
+                            unmet = _as_list(row.get('inclusion_criteria_not_met'))
+                            if unmet:
+                                 st.error(f"❌ Unmet Inclusions: {', '.join(unmet)}")
+                            met_excl = _as_list(row.get('exclusion_criteria_met'))
+                            if met_excl:
+                                 st.error(f"⛔ Met Exclusions: {', '.join(met_excl)}")
+
+                            missing = _as_list(row.get('missing_info'))
+                            if missing:
+                                st.warning(f"**Missing:** {'; '.join(missing)}")
 
-                        if pd.notna(row.get('missing_info')) and row.get('missing_info') and row.get('missing_info') != "[]":
-                            st.warning(f"**Missing:** {row.get('missing_info')}")
+        patient_view(file_mtime, filtered_df, df_patients, by_patient, selected_filter_trial)
 
 
 # --- TAB 2: MANUAL SCREENING ---
@@ -240,10 +548,6 @@ with tab2:
     st.markdown("### 🩺 Human-in-the-Loop Screening")
     st.info("Enter clinical data below to screen a new patient in real-time.")
 
-    # Load Trials for Manual
-    trial_files = glob.glob(os.path.join('trials', "*.md"))
-    trial_names = [os.path.basename(t).replace('.md', '') for t in trial_files]
-
     selected_manual_trial = st.selectbox("Select Protocol", trial_names, key="manual_trial")
 
     with st.container(border=True):
@@ -273,10 +577,10 @@ with tab2:
 
             trial_path = os.path.join('trials', f"{selected_manual_trial}.md")
             if os.path.exists(trial_path):
-                with open(trial_path, 'r') as f: trial_text = f.read()
+                trial_text = load_trial_text(trial_path)
 
                 with st.spinner("Analyzing criteria..."):
-                    result = screen_patient(patient_data, trial_text)
+                    result = deterministic_exclusion(patient_data, trial_text) or screen_patient(patient_data, trial_text, force_refresh=force_refresh)
 
                 # Result Display
                 r_dec = result.get('decision', 'ERROR')
@@ -291,80 +595,141 @@ with tab2:
                 
                 # Show parsed lists
                 col_i, col_e = st.columns(2)
+                # One element per list rather than one per criterion
                 with col_i:
                     if result.get('inclusion_criteria_not_met'):
-                        for x in result.get('inclusion_criteria_not_met'): st.error(f"❌ {x}")
+                        st.error("\n\n".join(f"❌ {x}" for x in result.get('inclusion_criteria_not_met')))
                 with col_e:
                     if result.get('exclusion_criteria_met'):
-                        for x in result.get('exclusion_criteria_met'): st.error(f"⛔ {x}")
+                        st.error("\n\n".join(f"⛔ {x}" for x in result.get('exclusion_criteria_met')))
             else:
                 st.error("Trial file not found.")
 
 
 # --- TAB 3: UPLOAD BATCH ---
 with tab3:
-    st.markdown("### 📂 Batch Processing")
-    uploaded_file = st.file_uploader("Drop patient CSV here", type=["csv"])
-
-    if len(trial_names) == 0:
-        st.error("No protocols found in the 'trials' folder.")
-    else:
-        selected_batch_trial = st.selectbox(
-            "Select Protocol for Batch Screening",
-            trial_names,
-            key="batch_trial"
-        )
-
-        if uploaded_file:
-            df_upload = pd.read_csv(uploaded_file)
-            st.markdown("#### 👀 Preview")
-            st.dataframe(df_upload.head(), use_container_width=True, hide_index=True)
-
-            if st.button("Start Batch Screening", type="primary", use_container_width=True):
-                if not os.environ.get("GEMINI_API_KEY") and not st.secrets.get("GEMINI_API_KEY"):
-                    st.error("API Key required.")
-                else:
-                    total = len(df_upload)
-                    results_batch = []
-                    failed = 0
-                    
-                    target_path = os.path.join("trials", f"{selected_batch_trial}.md")
-                    with open(target_path, "r") as f: batch_text = f.read()
+    # Fragment: uploads, previews and status checks rerun only this tab, not the dashboard
+    @st.fragment
+    def batch_panel(trial_names, max_concurrency, force_refresh):
+        st.markdown("### 📂 Batch Processing")
+        uploaded_file = st.file_uploader("Drop patient CSV here", type=["csv"])
+
+        if len(trial_names) == 0:
+            st.error("No protocols found in the 'trials' folder.")
+        else:
+            selected_batch_trial = st.selectbox(
+                "Select Protocol for Batch Screening",
+                trial_names,
+                key="batch_trial"
+            )
+
+            batch_mode = st.radio(
+                "Processing Mode",
+                ["Real-time", "Batch API (50% cost, async)"],
+                horizontal=True,
+                help="Batch API jobs are cheaper but can take minutes to hours to complete."
+            )
+
+            if uploaded_file:
+                df_upload = pd.read_csv(uploaded_file, engine='pyarrow')
+                st.markdown("#### 👀 Preview")
+                st.dataframe(df_upload.head(), use_container_width=True, hide_index=True)
+
+                if st.button("Start Batch Screening", type="primary", use_container_width=True):
+                    if not os.environ.get("GEMINI_API_KEY") and not st.secrets.get("GEMINI_API_KEY"):
+                        st.error("API Key required.")
+                    elif batch_mode != "Real-time":
+                        if load_pending_batch():
+                            st.warning("A batch job is already pending. Check its status below first.")
+                        else:
+                            target_path = os.path.join("trials", f"{selected_batch_trial}.md")
+                            batch_text = load_trial_text(target_path)
+
+                            with st.spinner("Submitting batch job..."):
+                                try:
+                                    job_name = batch_screen_patients(patient_records(df_upload), batch_text)
+                                except Exception as e:
+                                    st.error(f"Batch submission failed: {e}")
+                                    job_name = None
+                            if job_name:
+                                set_pending_batch({"job_name": job_name, "trial_name": selected_batch_trial, "total": len(df_upload)})
+                                st.success(f"Batch job submitted ({len(df_upload)} patients).")
+                    else:
+                        total = len(df_upload)
                     
-                    prog = st.progress(0)
-                    status = st.empty()
+                        target_path = os.path.join("trials", f"{selected_batch_trial}.md")
+                        batch_text = load_trial_text(target_path)
                     
-                    for idx, row in df_upload.iterrows():
-                        try:
-                            res = screen_patient(row.to_dict(), batch_text)
-                            results_batch.append({
-                                "patient_id": str(row.get("patient_id", "")),
-                                "trial_name": selected_batch_trial,
-                                "decision": res.get("decision", "ERROR"),
-                                "reason": res.get("reason", ""),
-                                "missing_info": res.get("missing_info", ""),
-                                "inclusion_criteria_not_met": str(res.get("inclusion_criteria_not_met", [])),
-                                "exclusion_criteria_met": str(res.get("exclusion_criteria_met", []))
-                            })
-                        except:
-                            failed += 1
-                        prog.progress((idx+1)/total)
-                        status.write(f"Processing {idx+1}/{total}...")
+                        prog = st.progress(0)
+                        status = st.empty()
                     
-                    df_res = pd.DataFrame(results_batch)
+                        # One vectorized conversion instead of a Series per row
+                        records = patient_records(df_upload)
+
+                        # Resume: skip patients already journaled by an interrupted run of this protocol
+                        journal = read_journal()
+                        done_ids = set()
+                        if not journal.empty:
+                            done_ids = set(journal.loc[journal['trial_name'] == selected_batch_trial, 'patient_id'])
+                            st.info(f"Resuming: {len(done_ids)} patients already screened.")
+                        todo = [rec for rec in records if str(rec["patient_id"]) not in done_ids]
+                        skipped = total - len(todo)
+
+                        update_every = max(1, total // 100)
+                        counts = {"done": skipped, "failed": 0}
+
+                        def on_row(row):
+                            counts["done"] += 1
+                            if row is None:
+                                counts["failed"] += 1
+                            else:
+                                jf.write(orjson.dumps(row) + b"\n")
+                                jf.flush()
+                            done = counts["done"]
+                            # ~100 UI updates per run instead of one per row
+                            if done % update_every == 0 or done == total:
+                                prog.progress(done/total)
+                                status.write(f"Processing {done}/{total}... (failures: {counts['failed']})")
+
+                        # I/O-bound: keep several Gemini requests in flight at once.
+                        # Each result is journaled as it lands so a crash loses nothing.
+                        with open(BATCH_JOURNAL_FILE, 'ab') as jf:
+                            rule_hits = run_screening(todo, batch_text, selected_batch_trial, max_concurrency, on_row, force_refresh)
+                        if rule_hits:
+                            st.caption(f"{rule_hits} LLM calls saved via deterministic rules.")
                     
-                    # Merge and Save
-                    if os.path.exists(DATA_FILE):
-                        old = pd.read_csv(DATA_FILE)
-                        # Remove old for this trial
-                        old = old[old['trial_name'] != selected_batch_trial]
-                        combined = pd.concat([old, df_res], ignore_index=True)
-                    else:
-                        combined = df_res
-                        
-                    combined.to_csv(DATA_FILE, index=False)
-                    st.success(f"Batch Complete! Screened {total} patients.")
-
+                        # Merge and Save, then drop the journal
+                        save_results(read_journal())
+                        os.remove(BATCH_JOURNAL_FILE)
+                        st.success(f"Batch Complete! Screened {total} patients.")
+
+            pending = load_pending_batch()
+            if pending:
+                st.markdown("#### ⏳ Pending Batch Job")
+                st.caption(f"{pending['trial_name']} • {pending['total']} patients • `{pending['job_name']}`")
+                if st.button("Check batch status", use_container_width=True):
+                    try:
+                        state = get_batch_state(pending['job_name'])
+                    except Exception as e:
+                        st.error(f"Status check failed: {e}")
+                        state = None
+
+                    if state == "JOB_STATE_SUCCEEDED":
+                        results_batch = [
+                            _result_row(pid, pending['trial_name'], res)
+                            for pid, res in collect_batch_results(pending['job_name'])
+                        ]
+                        save_results(pd.DataFrame(results_batch))
+                        set_pending_batch(None)
+                        st.success(f"Batch Complete! Screened {len(results_batch)} patients.")
+                    elif state in BATCH_FINAL_STATES:
+                        set_pending_batch(None)
+                        st.error(f"Batch job ended without results ({state}).")
+                    elif state:
+                        st.info(f"Still processing ({state}). Check again later.")
+
+
+    batch_panel(trial_names, max_concurrency, force_refresh)
 
 # --- TAB 4: MANAGE TRIALS ---
 with tab4:
@@ -393,33 +758,22 @@ with tab4:
                     
                     # 2. Auto-Run logic
                     if os.path.exists(PATIENT_FILE):
-                         df_pats = pd.read_csv(PATIENT_FILE)
+                         df_pats = pd.read_csv(PATIENT_FILE, engine='pyarrow')
                          st.info(f"Auto-screening {len(df_pats)} patients...")
                          res_auto = []
                          prog = st.progress(0)
-                         for i, row in df_pats.iterrows():
-                             try:
-                                 r = screen_patient(row.to_dict(), n_text)
-                                 res_auto.append({
-                                     "patient_id": str(row.get("patient_id")),
-                                     "trial_name": safe,
-                                     "decision": r.get("decision"),
-                                     "reason": r.get("reason"),
-                                     "missing_info": r.get("missing_info"),
-                                     "inclusion_criteria_not_met": str(r.get("inclusion_criteria_not_met", [])),
-                                     "exclusion_criteria_met": str(r.get("exclusion_criteria_met", []))
-                                 })
-                             except: pass
-                             prog.progress((i+1)/len(df_pats))
+                         done = {"n": 0}
+
+                         def on_row(row):
+                             done["n"] += 1
+                             if row is not None:
+                                 res_auto.append(row)
+                             prog.progress(done["n"] / len(df_pats))
+
+                         run_screening(patient_records(df_pats), n_text, safe, max_concurrency, on_row, force_refresh)
                          
                          df_new = pd.DataFrame(res_auto)
-                         if os.path.exists(DATA_FILE):
-                             old = pd.read_csv(DATA_FILE)
-                             old = old[old['trial_name'] != safe] # Replace old run
-                             cmbd = pd.concat([old, df_new], ignore_index=True)
-                         else:
-                             cmbd = df_new
-                         cmbd.to_csv(DATA_FILE, index=False)
+                         save_results(df_new, replace_trial=safe) # Replace old run
                          st.success("✅ Saved & Analyzed!")
                     else:
                          st.success("Saved (No patients found to analyze).")
@@ -1,19 +1,42 @@
 import pandas as pd
 import random
+import math
 
 # Load the dataset
 file_path = 'dm2_final_flat_000000000000.csv'
+n_target = 300
+chunk_size = 100_000
+
+# Select 300 random patients while streaming the file (reservoir sampling, Algorithm L),
+# so only the sample is kept in memory. If there are fewer than 300 patients, take all of them.
+rng = random.Random(42)
+reservoir = []
+total = 0
+w = math.exp(math.log(rng.random()) / n_target)
+next_pick = n_target + math.floor(math.log(rng.random()) / math.log(1 - w))
+
 try:
-    df = pd.read_csv(file_path)
-    print(f"Successfully loaded {file_path}. Total records: {len(df)}")
+    for chunk in pd.read_csv(file_path, chunksize=chunk_size):
+        start = total
+        total += len(chunk)
+
+        # Fill the reservoir with the first rows
+        if len(reservoir) < n_target:
+            take = min(n_target - len(reservoir), len(chunk))
+            reservoir.extend(chunk.iloc[i] for i in range(take))
+
+        # Then jump straight to the next row that enters the sample
+        while next_pick < total:
+            reservoir[rng.randrange(n_target)] = chunk.iloc[next_pick - start]
+            w *= math.exp(math.log(rng.random()) / n_target)
+            next_pick += math.floor(math.log(rng.random()) / math.log(1 - w)) + 1
+    print(f"Successfully loaded {file_path}. Total records: {total}")
 except FileNotFoundError:
     print(f"Error: File {file_path} not found.")
     exit(1)
 
-# Select 300 random patients
-# If there are fewer than 300 patients, take all of them.
-n_samples = min(300, len(df))
-sampled_df = df.sample(n=n_samples, random_state=42)
+n_samples = len(reservoir)
+sampled_df = pd.DataFrame(reservoir)
 
 # Save to new CSV
 output_file = 'patients_for_trial_screening.csv'
@@ -2,6 +2,8 @@ import pandas as pd
 import glob
 import os
 import json
+import orjson
+import re
 import time
 
 try:
@@ -13,8 +15,12 @@ except ImportError:
 # --- CONFIGURATION ---
 PATIENT_FILE = 'patients_for_trial_screening.csv'
 TRIALS_DIR = 'trials'
-OUTPUT_FILE = 'screening_results.csv'
+OUTPUT_DIR = 'screening_results'  # Parquet dataset shared with the dashboard, partitioned by trial
 MAX_PATIENTS = 5  # Start with a small batch
+REQUESTS_PER_MINUTE = 60  # Gemini quota; calls may burst up to this many, then are paced
+
+# Outermost {...} in a model response, compiled once
+JSON_OBJECT_RE = re.compile(r'\{.*\}', re.DOTALL)
 
 # --- API SETUP ---
 api_key = os.environ.get("GEMINI_API_KEY")
@@ -33,7 +39,7 @@ model = genai.GenerativeModel('gemini-2.0-flash')
 
 # --- LOAD DATA ---
 print(f"Loading patients from {PATIENT_FILE}...")
-df_patients = pd.read_csv(PATIENT_FILE)
+df_patients = pd.read_csv(PATIENT_FILE, engine='pyarrow')
 # Run on all patients
 patients_to_screen = df_patients.to_dict(orient='records')
 
@@ -48,6 +54,26 @@ for tf in trial_files:
 # --- DEFINITIONS ---
 results = []
 
+class TokenBucket:
+    """Allows `rate` calls per `per` seconds, bursting up to `rate`; acquire() sleeps only when the bucket is empty."""
+    def __init__(self, rate, per=60.0):
+        self.capacity = float(rate)
+        self.tokens = float(rate)
+        self.fill_rate = rate / per
+        self.last = time.monotonic()
+
+    def acquire(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.fill_rate)
+        self.last = now
+        if self.tokens < 1:
+            time.sleep((1 - self.tokens) / self.fill_rate)
+            self.last = time.monotonic()
+            self.tokens = 1.0
+        self.tokens -= 1
+
+rate_limiter = TokenBucket(REQUESTS_PER_MINUTE)
+
 def screen_patient(patient, trial_name, criteria_text):
     prompt = f"""
     You are an expert Clinical Research Associate.
@@ -57,7 +83,7 @@ def screen_patient(patient, trial_name, criteria_text):
     {criteria_text}
 
     ## PATIENT DATA
-    {json.dumps(patient, indent=2)}
+    {json.dumps(patient, separators=(",", ":"), ensure_ascii=False, default=str)}
 
     ## INSTRUCTIONS
     1. Compare the patient data against the inclusion and exclusion criteria.
@@ -73,15 +99,15 @@ def screen_patient(patient, trial_name, criteria_text):
     """
     
     try:
+        rate_limiter.acquire()
         response = model.generate_content(prompt)
         text_resp = response.text
         
         # Use regex to find the JSON object
-        import re
-        match = re.search(r'\{.*\}', text_resp, re.DOTALL)
+        match = JSON_OBJECT_RE.search(text_resp)
         if match:
             json_str = match.group(0)
-            return json.loads(json_str)
+            return orjson.loads(json_str)
         else:
             raise ValueError("No JSON found in response")
     except Exception as e:
@@ -98,18 +124,23 @@ for i, patient in enumerate(patients_to_screen):
     for trial_name, criteria in trials_data.items():
         result = screen_patient(patient, trial_name, criteria)
         
-        # Store result
+        # Store result (list columns are stored natively in Parquet)
+        missing = result.get("missing_info") or []
+        if isinstance(missing, str):
+            missing = [missing]
         row = {
-            "patient_id": pid,
+            "patient_id": str(pid),
             "trial_name": trial_name,
             "decision": result.get("decision"),
             "reason": result.get("reason"),
-            "missing_info": "; ".join(result.get("missing_info", []))
+            "missing_info": [str(m) for m in missing]
         }
         results.append(row)
-        time.sleep(1) # Rate limit pause
 
 # --- SAVE ---
 df_results = pd.DataFrame(results)
-df_results.to_csv(OUTPUT_FILE, index=False)
-print(f"Screening complete! Results saved to {OUTPUT_FILE}")
+# Append a new part file per trial; the dashboard keeps the latest row per patient and trial
+df_results.to_parquet(OUTPUT_DIR, partition_cols=['trial_name'], compression='zstd', index=False,
+                      basename_template=f"part-{time.time_ns()}-{{i}}.parquet")
+os.utime(OUTPUT_DIR)
+print(f"Screening complete! Results saved to {OUTPUT_DIR}/")
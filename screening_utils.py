@@ -1,8 +1,23 @@
 import google.generativeai as genai
+from google.api_core import exceptions as api_exceptions
+import asyncio
+import functools
+import hashlib
 import json
+import orjson
+import random
 import re
 import os
-from typing import Any, Dict, List, Tuple
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    # Newer SDK; only needed for the asynchronous Batch API
+    from google import genai as genai_batch
+except ImportError:
+    genai_batch = None
 
 ALLOWED_DECISIONS = {"ELIGIBLE", "INELIGIBLE", "UNCERTAIN", "ERROR"}
 
@@ -16,78 +31,228 @@ EXPECTED_KEYS = [
     "missing_info",
 ]
 
+# ```json ... ``` block in a model response
+_FENCE_RE = re.compile(r"```(?:json)?\s*(\{.*?\})\s*```", re.DOTALL | re.IGNORECASE)
+
+_JSON_DECODER = json.JSONDecoder()
+
+# Pregnancy mentions in patient diagnoses / comorbidities (a display hint only: coded histories
+# such as "complicating pregnancy, delivered" match too), and in a trial's exclusion criteria
+PREGNANCY_RE = re.compile(r"pregn|gestat", re.IGNORECASE)
+_TRIAL_PREGNANCY_RE = re.compile(r"pregnan", re.IGNORECASE)
+_EXCLUSION_SECTION_RE = re.compile(r"^#+\s*Exclusion Criteria\s*$(.*?)(?=^#+\s|\Z)", re.IGNORECASE | re.MULTILINE | re.DOTALL)
+
+# Numeric thresholds in a protocol's inclusion criteria (e.g. "aged ≥40 years", "HbA1c 7.0%-10.0%")
+_INCLUSION_SECTION_RE = re.compile(r"^#+\s*Inclusion Criteria\s*$(.*?)(?=^#+\s|\Z)", re.IGNORECASE | re.MULTILINE | re.DOTALL)
+_NUM = r"(\d+(?:\.\d+)?)"
+_RANGE_RE = re.compile(rf"{_NUM}\s*%?\s*(?:-|–|to|and)\s*{_NUM}", re.IGNORECASE)
+_LOWER_RE = re.compile(rf"(?:≥|>=|>|\bover\b|\bat least\b|\bolder than\b|\babove\b)\s*{_NUM}", re.IGNORECASE)
+_UPPER_RE = re.compile(rf"(?:≤|<=|<|\bunder\b|\bbelow\b|\bless than\b|\byounger than\b|\bup to\b)\s*{_NUM}", re.IGNORECASE)
+_BOUND_FIELDS = {
+    "age": re.compile(r"\bage[ds]?\b", re.IGNORECASE),
+    "hba1c": re.compile(r"\b(?:hb)?a1c\b", re.IGNORECASE),
+}
+# Clause boundaries within a criterion line ("and" only where it doesn't join a range, as in "between 40 and 70")
+_CLAUSE_SPLIT_RE = re.compile(r"[;,(]|\bwith\b|\band\b(?!\s*\d)", re.IGNORECASE)
+# Other quantities and units; their numbers must never be read as an age or HbA1c bound
+_OTHER_QUANTITY_RE = re.compile(
+    r"\b(?:bmi|weight|kg|mg|dl|mmol|glucose|egfr|creatinine|blood pressure|duration|hours?|days?|weeks?|months?|minutes?)\b",
+    re.IGNORECASE,
+)
+_NUMBER_RE = re.compile(_NUM)
+# Alternative or conditional thresholds ("or 18-80 years if on insulin", "for drug-naive patients",
+# "(≥ 6.5% if on insulin)"): which bound applies to a patient is for the model to decide
+_ALTERNATIVE_RE = re.compile(
+    r"\b(?:if|unless|otherwise|except|when|depending)\b|\bfor\b[^;,.]*\bpatients?\b|\bor\s*(?:[≥≤<>]|\d)|\([^)]*\d",
+    re.IGNORECASE,
+)
+
+# Transient API errors worth retrying (rate limit, timeout, overload), with exponential backoff
+_RETRYABLE_ERRORS = (api_exceptions.ResourceExhausted, api_exceptions.DeadlineExceeded, api_exceptions.ServiceUnavailable)
+MAX_RETRIES = 3
+
+# Cache of validated results, keyed by (model, trial, patient) content hash; in-process only
+# unless backed by a file with use_result_cache_file()
+_RESULT_CACHE: Dict[str, Dict[str, Any]] = {}
+_RESULT_CACHE_LOCK = threading.Lock()
+_RESULT_CACHE_FILE: Optional[str] = None
+RESULT_CACHE_MAX = 4096
+
+# Patient fields never sent to the model (identifiers carry no clinical information)
+_PROMPT_EXCLUDED_KEYS = {"patient_id"}
+
+# Structured-output schema for one screening result (Gemini JSON mode), so responses are
+# bare JSON objects that parse directly instead of being searched for in prose or fences
+_STRING_LIST_SCHEMA = {"type": "ARRAY", "items": {"type": "STRING"}}
+_RESULT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "decision": {"type": "STRING", "format": "enum", "enum": ["ELIGIBLE", "INELIGIBLE", "UNCERTAIN"]},
+        "reason": {"type": "STRING"},
+        **{k: _STRING_LIST_SCHEMA for k in EXPECTED_KEYS[2:]},
+    },
+    "required": list(EXPECTED_KEYS),
+}
+_BATCH_RESULT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "results": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"patient_index": {"type": "INTEGER"}, **_RESULT_SCHEMA["properties"]},
+                "required": ["patient_index"] + EXPECTED_KEYS,
+            },
+        },
+    },
+    "required": ["results"],
+}
+
+# Older models without JSON mode / response_schema support
+_NO_JSON_MODE_PREFIXES = ("gemini-1.0", "gemini-pro")
+
+# Batch API job states after which the job will not progress any further
+BATCH_FINAL_STATES = {
+    "JOB_STATE_SUCCEEDED",
+    "JOB_STATE_FAILED",
+    "JOB_STATE_CANCELLED",
+    "JOB_STATE_EXPIRED",
+}
+
+_configured_key: Optional[str] = None
+
+# Long-lived event loop, on a daemon thread, that every async Gemini call runs on. grpc.aio
+# channels stay bound to the loop they were first used on, and both the cached models and the
+# SDK's client registry outlive any single asyncio.run(); a closed loop would break them for good.
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_LOOP_LOCK = threading.Lock()
+
+# Model whose connection is opened in the background as soon as a key is configured
+_WARM_UP_MODEL = "gemini-2.0-flash"
+
+async def _warm_up(model_name: str) -> None:
+    """
+    Opens the model's sync and async gRPC channels ahead of the first screening call
+    (count_tokens is free). Runs on the shared loop, the only loop the async channel is used on.
+    """
+    # Best effort; a failed warm-up just leaves the first real call to open the channel
+    try:
+        model = _get_model(model_name)
+    except Exception:
+        return
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(
+        loop.run_in_executor(None, model.count_tokens, "ping"),
+        model.count_tokens_async("ping"),
+        return_exceptions=True,
+    )
+
 def configure_genai(api_key: str) -> None:
     """Configures the Gemini API with the provided key."""
     if not api_key:
         raise ValueError("API Key is required.")
-    os.environ["GEMINI_API_KEY"] = api_key
-    genai.configure(api_key=api_key)
+    global _configured_key
+    if api_key != _configured_key:
+        # genai.configure discards the SDK's clients (and their open channels), so it only
+        # runs when the key changes; models built under a previous key are rebuilt on next use.
+        # Keeping the async client alive is safe because it is only ever used on _shared_loop().
+        genai.configure(api_key=api_key)
+        _get_model.cache_clear()
+        _configured_key = api_key
+        asyncio.run_coroutine_threadsafe(_warm_up(_WARM_UP_MODEL), _shared_loop())
 
-def _extract_json_candidate(text: str) -> str:
+def _extract_json(text: str) -> Any:
     """
-    Extract a JSON object from a model response text.
-    Tries fenced code blocks first, then falls back to brace matching.
+    Extract and parse the JSON object in a model response text, in a single pass.
+    Tries fenced code blocks first, then falls back to scanning for a decodable object.
+    Returns None if the text holds no JSON object; raises ValueError for a malformed fenced block.
     """
     if not text:
-        return ""
+        return None
 
     # Prefer ```json ... ``` blocks when available
-    fence_match = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", text, re.DOTALL | re.IGNORECASE)
+    fence_match = _FENCE_RE.search(text)
     if fence_match:
-        return fence_match.group(1).strip()
+        return orjson.loads(fence_match.group(1))
 
-    # Fallback: attempt to find the first top-level JSON object via brace matching
+    # Fallback: the first "{" that starts a complete JSON object. raw_decode scans in C
+    # and, unlike plain brace counting, is not fooled by braces inside string values.
     start = text.find("{")
-    if start == -1:
-        return ""
+    while start != -1:
+        try:
+            obj, _ = _JSON_DECODER.raw_decode(text, start)
+            return obj
+        except json.JSONDecodeError:
+            start = text.find("{", start + 1)
 
-    depth = 0
-    for i in range(start, len(text)):
-        ch = text[i]
-        if ch == "{":
-            depth += 1
-        elif ch == "}":
-            depth -= 1
-            if depth == 0:
-                return text[start : i + 1].strip()
+    return None
 
-    return ""
+def _strip_items(value: List[Any]) -> List[str]:
+    items = (str(x).strip() for x in value)
+    return [x for x in items if x]
 
-def _ensure_list(value: Any) -> List[str]:
-    """Normalize a field into a list of strings."""
-    if value is None:
-        return []
-    if isinstance(value, list):
-        return [str(x).strip() for x in value if str(x).strip()]
-    if isinstance(value, str):
-        v = value.strip()
-        return [v] if v else []
-    # Any other type -> single-item list
+def _single_item(value: Any) -> List[str]:
     s = str(value).strip()
     return [s] if s else []
 
+# Per-type handlers for _ensure_list; any other type becomes a single-item list
+_LIST_HANDLERS = {
+    list: _strip_items,
+    str: _single_item,
+    type(None): lambda _: [],
+}
+
+def _ensure_list(value: Any) -> List[str]:
+    """Normalize a field into a list of strings."""
+    return _LIST_HANDLERS.get(type(value), _single_item)(value)
+
+# Known decision spellings -> canonical decision; anything else is invalid -> ERROR
+_DECISION_MAP = {
+    "ELIGIBLE": "ELIGIBLE",
+    "INELIG": "ELIGIBLE",
+    "INELIGIBLE": "INELIGIBLE",
+    "NOT_ELIGIBLE": "INELIGIBLE",
+    "INELIGIBLE.": "INELIGIBLE",
+    "UNCERTAIN": "UNCERTAIN",
+    "UNKNOWN": "UNCERTAIN",
+    "UNSURE": "UNCERTAIN",
+    "ERROR": "ERROR",
+}
+
 def _normalize_decision(decision: Any) -> str:
     """Normalize decision to one of the allowed decisions."""
     if decision is None:
         return "ERROR"
-    d = str(decision).strip().upper()
-    # Common variants
-    if d in {"ELIGIBLE", "INELIG"}:
-        return "ELIGIBLE"
-    if d in {"INELIGIBLE", "NOT_ELIGIBLE", "INELIGIBLE."}:
-        return "INELIGIBLE"
-    if d in {"UNCERTAIN", "UNKNOWN", "UNSURE"}:
-        return "UNCERTAIN"
-    if d == "ERROR":
-        return "ERROR"
-    # Anything else is invalid -> ERROR
-    return "ERROR"
+    return _DECISION_MAP.get(str(decision).strip().upper(), "ERROR")
+
+_LIST_KEYS = [k for k in EXPECTED_KEYS if k not in ("decision", "reason")]
+
+def _is_well_formed(result: Dict[str, Any]) -> bool:
+    """True if the result already has the canonical shape and passes the sanity rules unchanged."""
+    if not all(k in result for k in EXPECTED_KEYS):
+        return False
+    decision, reason = result["decision"], result["reason"]
+    if decision not in ALLOWED_DECISIONS or not isinstance(reason, str):
+        return False
+    if decision == "ERROR" and not reason:
+        return False
+    for k in _LIST_KEYS:
+        items = result[k]
+        if type(items) is not list or not all(type(x) is str and x and x == x.strip() for x in items):
+            return False
+        if decision == "ELIGIBLE" and items and k in ("exclusion_criteria_met", "inclusion_criteria_not_met", "missing_info"):
+            return False
+    return True
 
 def _validate_and_fix_result(result: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
     """
     Validate model output shape and enforce basic consistency rules.
     Returns (fixed_result, validation_warnings).
     """
+    # Fast path: a correctly shaped response (the usual case at temperature 0) needs no rewrite
+    if _is_well_formed(result):
+        return result, []
+
     warnings: List[str] = []
 
     # Ensure all expected keys exist
@@ -114,21 +279,20 @@ def _validate_and_fix_result(result: Dict[str, Any]) -> Tuple[Dict[str, Any], Li
     result["exclusion_criteria_not_met"] = _ensure_list(result.get("exclusion_criteria_not_met"))
     result["missing_info"] = _ensure_list(result.get("missing_info"))
 
-    # Sanity checks (basic clinical logic consistency)
-    # Rule 1: Any exclusion met => should not be ELIGIBLE
-    if result["decision"] == "ELIGIBLE" and len(result["exclusion_criteria_met"]) > 0:
-        result["decision"] = "INELIGIBLE"
-        warnings.append("Decision changed to INELIGIBLE because at least one exclusion criterion was met.")
-
-    # Rule 2: Any inclusion not met => should not be ELIGIBLE
-    if result["decision"] == "ELIGIBLE" and len(result["inclusion_criteria_not_met"]) > 0:
-        result["decision"] = "INELIGIBLE"
-        warnings.append("Decision changed to INELIGIBLE because at least one inclusion criterion was not met.")
-
-    # Rule 3: If key patient fields are missing, UNCERTAIN is safer than ELIGIBLE
-    if result["decision"] == "ELIGIBLE" and len(result["missing_info"]) > 0:
-        result["decision"] = "UNCERTAIN"
-        warnings.append("Decision changed to UNCERTAIN because missing information was reported.")
+    # Sanity checks (basic clinical logic consistency); the most conservative downgrade wins
+    if result["decision"] == "ELIGIBLE":
+        # Rule 1: Any exclusion met => should not be ELIGIBLE
+        if result["exclusion_criteria_met"]:
+            result["decision"] = "INELIGIBLE"
+            warnings.append("Decision changed to INELIGIBLE because at least one exclusion criterion was met.")
+        # Rule 2: Any inclusion not met => should not be ELIGIBLE
+        elif result["inclusion_criteria_not_met"]:
+            result["decision"] = "INELIGIBLE"
+            warnings.append("Decision changed to INELIGIBLE because at least one inclusion criterion was not met.")
+        # Rule 3: If key patient fields are missing, UNCERTAIN is safer than ELIGIBLE
+        elif result["missing_info"]:
+            result["decision"] = "UNCERTAIN"
+            warnings.append("Decision changed to UNCERTAIN because missing information was reported.")
 
     # Ensure decision is always allowed
     if result["decision"] not in ALLOWED_DECISIONS:
@@ -146,36 +310,50 @@ def _validate_and_fix_result(result: Dict[str, Any]) -> Tuple[Dict[str, Any], Li
 
     return result, warnings
 
-def screen_patient(patient_data: Dict[str, Any], trial_text: str, model_name: str = "gemini-2.0-flash") -> Dict[str, Any]:
+def _is_blank(value: Any) -> bool:
+    if value is None:
+        return True
+    if isinstance(value, str):
+        return not value.strip()
+    try:
+        return bool(value != value)  # NaN
+    except TypeError:
+        return True  # pd.NA
+
+def _compact_patient(patient_data: Dict[str, Any]) -> Dict[str, Any]:
     """
-    Screens a single patient against trial criteria using Gemini.
+    Patient fields as sent to the model: identifiers and empty values dropped, and
+    repeated entries in ';'-separated lists (e.g. "Amlodipine; amLODIPine") collapsed.
     """
-    # Basic input checks
-    if not isinstance(patient_data, dict) or not patient_data:
-        return {
-            "decision": "ERROR",
-            "reason": "Invalid patient_data dict.",
-            "missing_info": ["patient_data"],
-        }
-
-    try:
-        model = genai.GenerativeModel(model_name)
-    except Exception as e:
-        return {
-            "decision": "ERROR",
-            "reason": f"Model init failed: {e}",
-            "missing_info": [],
-        }
+    compact: Dict[str, Any] = {}
+    for key, value in patient_data.items():
+        if key in _PROMPT_EXCLUDED_KEYS or _is_blank(value):
+            continue
+        if isinstance(value, str) and ";" in value:
+            seen, items = set(), []
+            for item in value.split(";"):
+                item = item.strip()
+                if item and item.lower() not in seen:
+                    seen.add(item.lower())
+                    items.append(item)
+            value = "; ".join(items)
+        compact[key] = value
+    return compact
 
-    prompt = f"""
+# Fixed parts of the screening prompts, built once; only the trial and patient blocks vary per call
+_PROMPT_HEAD = """
     You are an expert Clinical Research Associate.
     Your task is to determine if a patient is ELIGIBLE, INELIGIBLE, or UNCERTAIN for a clinical trial.
 
     ## TRIAL CRITERIA
-    {trial_text}
+    """
+
+_PROMPT_PATIENT_HEADER = """
 
     ## PATIENT DATA
-    {json.dumps(patient_data, indent=2)}
+    """
+
+_PROMPT_TAIL = """
 
     ## INSTRUCTIONS
     1. Analyze the patient data against every single inclusion and exclusion criterion.
@@ -187,7 +365,7 @@ def screen_patient(patient_data: Dict[str, Any], trial_text: str, model_name: st
     3. Output your final decision in strict JSON format.
     
     ## JSON OUTPUT FORMAT
-    {{
+    {
       "decision": "ELIGIBLE" | "INELIGIBLE" | "UNCERTAIN",
       "reason": "The patient is eligible based on age (45 vs >18) and diagnosis. However, ... [Detailed clinical narrative]",
       "inclusion_criteria_met": ["list of strings"],
@@ -195,42 +373,470 @@ def screen_patient(patient_data: Dict[str, Any], trial_text: str, model_name: st
       "exclusion_criteria_met": ["list of strings (bad)"],
       "exclusion_criteria_not_met": ["list of strings (good)"],
       "missing_info": ["list of strings"]
-    }}
+    }
+    """
+
+_BATCH_PROMPT_HEAD = """
+    You are an expert Clinical Research Associate.
+    Your task is to determine, for each patient below, if they are ELIGIBLE, INELIGIBLE, or UNCERTAIN for a clinical trial.
+    Assess every patient independently; never carry facts over from one patient to another.
+
+    ## TRIAL CRITERIA
+    """
+
+_BATCH_PROMPT_TAIL = """
+
+    ## INSTRUCTIONS
+    1. Analyze each patient's data against every single inclusion and exclusion criterion.
+    2. **CRITICAL:** Provide a DETAILED reasoning in each 'reason' field, but write it as a natural clinical summary.
+       - Quote specific patient values and trial limits.
+       - Explain exactly why the match failed or succeeded.
+       - **DO NOT** use "STEP 1", "STEP 2" labels. Write fluidly.
+       - Be professional, verbose, and clear.
+    3. Output your final decisions in strict JSON format, one entry per patient, in patient order.
+
+    ## JSON OUTPUT FORMAT
+    {
+      "results": [
+        {
+          "patient_index": 1,
+          "decision": "ELIGIBLE" | "INELIGIBLE" | "UNCERTAIN",
+          "reason": "The patient is eligible based on age (45 vs >18) and diagnosis. However, ... [Detailed clinical narrative]",
+          "inclusion_criteria_met": ["list of strings"],
+          "inclusion_criteria_not_met": ["list of strings"],
+          "exclusion_criteria_met": ["list of strings (bad)"],
+          "exclusion_criteria_not_met": ["list of strings (good)"],
+          "missing_info": ["list of strings"]
+        }
+      ]
+    }
+    """
+
+class TrialContext:
+    """
+    Per-trial work shared by every patient screened against that trial: the frozen prompt
+    prefix (instructions + criteria) and the trial's cache-key digest.
+    The prefix is identical across a cohort's prompts, which also lets Gemini's implicit
+    context caching reuse it server-side.
+    """
+
+    def __init__(self, trial_text: str):
+        self.trial_text = trial_text
+        self.prefix = "".join((_PROMPT_HEAD, trial_text, _PROMPT_PATIENT_HEADER))
+        self.digest = hashlib.blake2b(trial_text.encode()).digest()
+
+    def prompt(self, patient_data: Dict[str, Any]) -> str:
+        patient_json = orjson.dumps(_compact_patient(patient_data), default=str).decode()
+        return "".join((self.prefix, patient_json, _PROMPT_TAIL))
+
+@functools.lru_cache(maxsize=32)
+def trial_context(trial_text: str) -> TrialContext:
+    """TrialContext for a protocol text, built once per distinct text."""
+    return TrialContext(trial_text)
+
+def _build_prompt(patient_data: Dict[str, Any], trial_text: str) -> str:
+    """Builds the screening prompt for one patient against one trial."""
+    return trial_context(trial_text).prompt(patient_data)
+
+def _build_batch_prompt(patients: List[Dict[str, Any]], trial_text: str) -> str:
+    """Builds one prompt screening several patients against the same trial (criteria sent once)."""
+    patient_sections = "\n\n".join(
+        f"    ## PATIENT {i}\n    {orjson.dumps(_compact_patient(p), default=str).decode()}"
+        for i, p in enumerate(patients, start=1)
+    )
+    return "".join((_BATCH_PROMPT_HEAD, trial_text, "\n\n", patient_sections, _BATCH_PROMPT_TAIL))
+
+def _supports_json_mode(model_name: str) -> bool:
+    return not model_name.removeprefix("models/").startswith(_NO_JSON_MODE_PREFIXES)
+
+@functools.lru_cache(maxsize=16)
+def _generation_config(model_name: str, batch: bool = False) -> Any:
+    """Deterministic generation config, constrained to the result schema where the model supports it."""
+    if not _supports_json_mode(model_name):
+        return genai.types.GenerationConfig(temperature=0.0)
+    return genai.types.GenerationConfig(
+        temperature=0.0,
+        response_mime_type="application/json",
+        response_schema=_BATCH_RESULT_SCHEMA if batch else _RESULT_SCHEMA,
+    )
+
+def _parse_json(text_resp: str) -> Any:
+    """Parses a JSON-mode response directly; falls back to extraction for free-form text."""
+    try:
+        return orjson.loads(text_resp)
+    except orjson.JSONDecodeError:
+        return _extract_json(text_resp)
+
+def _parse_batch_text(text_resp: str, n_patients: int) -> List[Dict[str, Any]]:
     """
+    Splits a multi-patient response into one validated result per patient, in input order.
+    Entries are matched on patient_index when it numbers the patients exactly 1..n, else by
+    position if there is one entry per patient; otherwise every patient gets an ERROR result.
+    """
+    def _error(reason: str) -> Dict[str, Any]:
+        return {"decision": "ERROR", "reason": reason, "missing_info": []}
 
     try:
-        # RE-INJECTED TEMPERATURE 0.0
-        generation_config = genai.types.GenerationConfig(temperature=0.0)
-        
-        response = model.generate_content(prompt, generation_config=generation_config)
-        text_resp = getattr(response, "text", "") or ""
-
-        json_candidate = _extract_json_candidate(text_resp)
-        if not json_candidate:
-            return {
-                "decision": "ERROR",
-                "reason": "No JSON found in model response. Raw: " + text_resp[:100],
-                "missing_info": [],
-            }
+        parsed = _parse_json(text_resp)
+    except ValueError as e:
+        return [_error(f"Failed to parse JSON: {str(e)}") for _ in range(n_patients)]
+    if parsed is None:
+        return [_error("No JSON found in model response. Raw: " + text_resp[:100]) for _ in range(n_patients)]
+
+    entries = parsed.get("results") if isinstance(parsed, dict) else None
+    if not isinstance(entries, list):
+        return [_error("Batch response has no 'results' list.") for _ in range(n_patients)]
+
+    if not all(isinstance(entry, dict) for entry in entries):
+        return [_error("Batch response has malformed entries.") for _ in range(n_patients)]
+
+    # Trust patient_index only if it numbers the patients exactly 1..n; otherwise (e.g. a 0-based
+    # numbering) match by position, which needs exactly one entry per patient
+    by_index: Dict[int, Dict[str, Any]] = {}
+    for entry in entries:
+        try:
+            by_index.setdefault(int(entry.get("patient_index")), entry)
+        except (TypeError, ValueError):
+            pass
+    if len(entries) != n_patients:
+        return [_error(f"Batch response has {len(entries)} verdicts for {n_patients} patients.") for _ in range(n_patients)]
+    if set(by_index) != set(range(1, n_patients + 1)):
+        by_index = dict(enumerate(entries, start=1))
+
+    results = []
+    for i in range(1, n_patients + 1):
+        entry = {k: v for k, v in by_index[i].items() if k != "patient_index"}
+        results.append(_validate_and_fix_result(entry)[0])
+    return results
+
+def _parse_model_text(text_resp: str) -> Dict[str, Any]:
+    """
+    Turns raw model output into a validated result dict.
+    Always returns a dict; failures are reported with decision ERROR.
+    """
+    try:
+        parsed = _parse_json(text_resp)
+    except ValueError as e:
+        return {
+            "decision": "ERROR",
+            "reason": f"Failed to parse JSON: {str(e)}",
+            "missing_info": [],
+        }
+
+    if parsed is None:
+        return {
+            "decision": "ERROR",
+            "reason": "No JSON found in model response. Raw: " + text_resp[:100],
+            "missing_info": [],
+        }
+
+    if not isinstance(parsed, dict):
+        return {
+            "decision": "ERROR",
+            "reason": "Parsed JSON is not an object.",
+            "missing_info": [],
+        }
+
+    fixed, _warnings = _validate_and_fix_result(parsed)
+    return fixed
+
+def _backoff_delay(attempt: int) -> float:
+    return 2 ** attempt + random.random()
+
+def _generate(model: Any, prompt: str, generation_config: Any, stream: bool = False) -> Any:
+    """model.generate_content, retried on transient API errors."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return model.generate_content(prompt, generation_config=generation_config, stream=stream)
+        except _RETRYABLE_ERRORS:
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(_backoff_delay(attempt))
 
+async def _generate_async(model: Any, prompt: str, generation_config: Any, stream: bool = False) -> Any:
+    """model.generate_content_async, retried on transient API errors without blocking the event loop."""
+    for attempt in range(MAX_RETRIES + 1):
         try:
-            parsed = json.loads(json_candidate)
+            return await model.generate_content_async(prompt, generation_config=generation_config, stream=stream)
+        except _RETRYABLE_ERRORS:
+            if attempt == MAX_RETRIES:
+                raise
+            await asyncio.sleep(_backoff_delay(attempt))
+
+def _chunk_text(chunk: Any) -> str:
+    try:
+        return chunk.text or ""
+    except ValueError:
+        return ""  # Chunk without text parts (e.g. only a finish reason)
+
+def _leading_object(text: str) -> Optional[Dict[str, Any]]:
+    """The JSON object starting at the first "{" if it is already complete, else None."""
+    start = text.find("{")
+    if start == -1:
+        return None
+    try:
+        obj, _ = _JSON_DECODER.raw_decode(text, start)
+    except json.JSONDecodeError:
+        return None
+    return obj if isinstance(obj, dict) else None
+
+def _stream_result(parts: List[str], piece: str) -> Optional[Dict[str, Any]]:
+    parts.append(piece)
+    # Only worth a decode attempt once a closing brace has arrived
+    return _leading_object("".join(parts)) if "}" in piece else None
+
+def _read_stream(response: Any) -> Tuple[Optional[Dict[str, Any]], str]:
+    """
+    Consumes a streamed response until its JSON object is complete, then closes the stream
+    (anything the model writes after the object is never waited for).
+    Only used for free-form models: in JSON mode the object's closing brace ends the response.
+    Returns (parsed object or None, text received).
+    """
+    parts: List[str] = []
+    chunks = iter(response)
+    try:
+        for chunk in chunks:
+            parsed = _stream_result(parts, _chunk_text(chunk))
+            if parsed is not None:
+                return parsed, "".join(parts)
+        return None, "".join(parts)
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+async def _read_stream_async(response: Any) -> Tuple[Optional[Dict[str, Any]], str]:
+    """Async counterpart of _read_stream."""
+    parts: List[str] = []
+    chunks = aiter(response)
+    try:
+        async for chunk in chunks:
+            parsed = _stream_result(parts, _chunk_text(chunk))
+            if parsed is not None:
+                return parsed, "".join(parts)
+        return None, "".join(parts)
+    finally:
+        if hasattr(chunks, "aclose"):
+            await chunks.aclose()
+
+def _streamed_result(parsed: Optional[Dict[str, Any]], text_resp: str) -> Dict[str, Any]:
+    if parsed is not None:
+        return _validate_and_fix_result(parsed)[0]
+    return _parse_model_text(text_resp)
+
+def _canonical_value(value: Any) -> Any:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = " ".join(str(value).split()).casefold()
+    if ";" in text:
+        return sorted(filter(None, {item.strip() for item in text.split(";")}))
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+def _canonical_patient(patient_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Cache-key form of a patient: what the model is sent (see _compact_patient), with
+    formatting-only differences removed -- whitespace, letter case, list order, "7" vs "7.0".
+    Records that differ only in identifiers or such formatting share a cache entry.
+    """
+    return {k.casefold(): _canonical_value(v) for k, v in _compact_patient(patient_data).items()}
+
+def _result_cache_key(patient_data: Dict[str, Any], trial_text: str, model_name: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(model_name.encode())
+    h.update(trial_context(trial_text).digest)
+    # orjson emits bytes directly, so the canonical patient is hashed without an encode pass
+    h.update(orjson.dumps(_canonical_patient(patient_data), option=orjson.OPT_SORT_KEYS, default=str))
+    return h.hexdigest()
+
+def _cache_get(key: Optional[str]) -> Optional[Dict[str, Any]]:
+    if key is None:
+        return None
+    with _RESULT_CACHE_LOCK:
+        hit = _RESULT_CACHE.get(key)
+    return dict(hit) if hit is not None else None
+
+def _cache_put(key: Optional[str], result: Dict[str, Any]) -> None:
+    # Failures are never cached, so they are retried on the next call
+    if key is None or result.get("decision") == "ERROR":
+        return
+    with _RESULT_CACHE_LOCK:
+        _RESULT_CACHE[key] = dict(result)
+        if _RESULT_CACHE_FILE is not None:
+            with open(_RESULT_CACHE_FILE, "ab") as f:
+                f.write(orjson.dumps({"key": key, "result": result}) + b"\n")
+        elif len(_RESULT_CACHE) > RESULT_CACHE_MAX:
+            _RESULT_CACHE.pop(next(iter(_RESULT_CACHE)))  # Oldest entry first
+
+def use_result_cache_file(path: str) -> None:
+    """
+    Backs the result cache with an append-only JSONL file, so results survive restarts:
+    the entries already in it are loaded, and every new result is appended (the file is
+    then the size bound, so nothing is evicted from memory). Calling it again with the
+    same path is a no-op.
+    """
+    global _RESULT_CACHE_FILE
+    with _RESULT_CACHE_LOCK:
+        if path == _RESULT_CACHE_FILE:
+            return
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        entry = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        continue  # Torn last line from an interrupted write
+                    _RESULT_CACHE[entry["key"]] = entry["result"]
+        _RESULT_CACHE_FILE = path
+
+@functools.lru_cache(maxsize=8)
+def _get_model(model_name: str):
+    """
+    One GenerativeModel per model name, reused across calls (and kept for the process
+    lifetime), so every call goes through the same long-lived client connection.
+    """
+    return genai.GenerativeModel(model_name)
+
+def _prepare_call(patient_data: Dict[str, Any], model_name: str) -> Tuple[Any, Optional[Dict[str, Any]]]:
+    """
+    Shared input checks and model setup for the sync and async screeners.
+    Returns (model, None) on success or (None, error_result).
+    """
+    # Basic input checks
+    if not isinstance(patient_data, dict) or not patient_data:
+        return None, {
+            "decision": "ERROR",
+            "reason": "Invalid patient_data dict.",
+            "missing_info": ["patient_data"],
+        }
+
+    try:
+        return _get_model(model_name), None
+    except Exception as e:
+        return None, {
+            "decision": "ERROR",
+            "reason": f"Model init failed: {e}",
+            "missing_info": [],
+        }
+
+def screen_patient(patient_data: Dict[str, Any], trial_text: str, model_name: str = "gemini-2.0-flash", use_cache: bool = True, force_refresh: bool = False) -> Dict[str, Any]:
+    """
+    Screens a single patient against trial criteria using Gemini.
+    With use_cache, an identical (patient, trial, model) request seen earlier (in this
+    process, or in the cache file, see use_result_cache_file) returns the stored result
+    without calling the API. force_refresh calls the API anyway and replaces the stored result.
+    """
+    model, error = _prepare_call(patient_data, model_name)
+    if error:
+        return error
+
+    key = _result_cache_key(patient_data, trial_text, model_name) if use_cache else None
+    cached = None if force_refresh else _cache_get(key)
+    if cached is not None:
+        return cached
+
+    prompt = _build_prompt(patient_data, trial_text)
+
+    try:
+        # Temperature 0.0, JSON mode where supported
+        generation_config = _generation_config(model_name)
+
+        if _supports_json_mode(model_name):
+            # The response is just the JSON object, so there is nothing to stop early
+            result = _parse_model_text(_chunk_text(_generate(model, prompt, generation_config)))
+        else:
+            # Streamed, so reading stops as soon as the JSON object closes
+            response = _generate(model, prompt, generation_config, stream=True)
+            result = _streamed_result(*_read_stream(response))
+        _cache_put(key, result)
+        return result
+
+    except Exception as e:
+        return {
+            "decision": "ERROR",
+            "reason": str(e),
+            "missing_info": [],
+        }
+
+def screen_patients_batch(patients: List[Dict[str, Any]], trial_text: str, model_name: str = "gemini-2.0-flash", batch_size: int = 8) -> List[Dict[str, Any]]:
+    """
+    Screens several patients with one Gemini call per `batch_size` patients, so the trial
+    criteria are sent once per call instead of once per patient.
+    Returns one validated result per input patient, in the same order.
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(patients)
+    valid = []
+    for i, patient in enumerate(patients):
+        _, error = _prepare_call(patient, model_name)
+        if error:
+            results[i] = error
+        else:
+            valid.append(i)
+
+    generation_config = _generation_config(model_name, batch=True)
+    for start in range(0, len(valid), max(1, batch_size)):
+        chunk = valid[start:start + max(1, batch_size)]
+        try:
+            response = _generate(
+                _get_model(model_name),
+                _build_batch_prompt([patients[i] for i in chunk], trial_text),
+                generation_config,
+            )
+            chunk_results = _parse_batch_text(getattr(response, "text", "") or "", len(chunk))
         except Exception as e:
-            return {
-                "decision": "ERROR",
-                "reason": f"Failed to parse JSON: {str(e)}",
-                "missing_info": [],
-            }
+            chunk_results = [{"decision": "ERROR", "reason": str(e), "missing_info": []} for _ in chunk]
+        for i, res in zip(chunk, chunk_results):
+            results[i] = res
+    return results
 
-        if not isinstance(parsed, dict):
-            return {
-                "decision": "ERROR",
-                "reason": "Parsed JSON is not an object.",
-                "missing_info": [],
-            }
+def _shared_loop() -> asyncio.AbstractEventLoop:
+    global _LOOP
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            _LOOP = asyncio.new_event_loop()
+            threading.Thread(target=_LOOP.run_forever, name="gemini-async", daemon=True).start()
+        return _LOOP
+
+async def _on_shared_loop(coro: Any) -> Any:
+    """Awaits a coroutine on the shared loop, whichever event loop the caller is running."""
+    loop = _shared_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+async def screen_patient_async(patient_data: Dict[str, Any], trial_text: str, model_name: str = "gemini-2.0-flash", use_cache: bool = True, force_refresh: bool = False) -> Dict[str, Any]:
+    """
+    Async variant of screen_patient, so many patients can be in flight at once.
+    Shares screen_patient's result cache. Safe to call from successive asyncio.run() calls:
+    the request itself always runs on the module's long-lived loop.
+    """
+    return await _on_shared_loop(_screen_patient_async(patient_data, trial_text, model_name, use_cache, force_refresh))
 
-        fixed, _warnings = _validate_and_fix_result(parsed)
-        return fixed
+async def _screen_patient_async(patient_data: Dict[str, Any], trial_text: str, model_name: str, use_cache: bool, force_refresh: bool) -> Dict[str, Any]:
+    model, error = _prepare_call(patient_data, model_name)
+    if error:
+        return error
+
+    key = _result_cache_key(patient_data, trial_text, model_name) if use_cache else None
+    cached = None if force_refresh else _cache_get(key)
+    if cached is not None:
+        return cached
+
+    prompt = _build_prompt(patient_data, trial_text)
+
+    try:
+        generation_config = _generation_config(model_name)
+
+        if _supports_json_mode(model_name):
+            result = _parse_model_text(_chunk_text(await _generate_async(model, prompt, generation_config)))
+        else:
+            response = await _generate_async(model, prompt, generation_config, stream=True)
+            result = _streamed_result(*await _read_stream_async(response))
+        _cache_put(key, result)
+        return result
 
     except Exception as e:
         return {
@@ -239,8 +845,203 @@ def screen_patient(patient_data: Dict[str, Any], trial_text: str, model_name: st
             "missing_info": [],
         }
 
+async def _screen_cohort_async(patients: List[Dict[str, Any]], trial_text: str, model_name: str, concurrency: int) -> List[Dict[str, Any]]:
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def _one(patient: Dict[str, Any]) -> Dict[str, Any]:
+        async with sem:
+            return await screen_patient_async(patient, trial_text, model_name)
 
+    return await asyncio.gather(*(_one(p) for p in patients))
 
+def screen_cohort(patients: List[Dict[str, Any]], trial_text: str, model_name: str = "gemini-2.0-flash", concurrency: int = 10) -> List[Dict[str, Any]]:
+    """
+    Screens many patients concurrently (at most `concurrency` requests in flight).
+    Synchronous entry point for scripts; returns one result per patient, in input order.
+    Runs on the module's long-lived loop, so it can be called any number of times; it blocks
+    the calling thread (from async code, use screen_patient_async instead).
+    """
+    future = asyncio.run_coroutine_threadsafe(
+        _screen_cohort_async(patients, trial_text, model_name, concurrency), _shared_loop()
+    )
+    return future.result()
+
+@functools.lru_cache(maxsize=32)
+def extract_numeric_bounds(trial_text: str) -> Dict[str, Any]:
+    """
+    Parses age and HbA1c thresholds out of the trial's inclusion criteria.
+    Returns {"age": (min, max), "hba1c": (min, max), "criteria": {field: line}, "exclusions": [...]},
+    with None for an open end; fields whose criterion could not be read are left out.
+    "exclusions" holds "pregnancy" when the Exclusion Criteria section mentions it.
+    Cached per protocol text, so treat the result as read-only.
+    """
+    bounds: Dict[str, Any] = {"criteria": {}, "exclusions": []}
+    exclusion_section = _EXCLUSION_SECTION_RE.search(trial_text)
+    if exclusion_section and _TRIAL_PREGNANCY_RE.search(exclusion_section.group(1)):
+        bounds["exclusions"].append("pregnancy")
+
+    section = _INCLUSION_SECTION_RE.search(trial_text)
+    for line in (section.group(1) if section else "").splitlines():
+        line = line.strip().lstrip("-*").strip()
+        clauses = _CLAUSE_SPLIT_RE.split(line)
+        # Leave lines with alternative thresholds, or with a threshold in a clause naming no
+        # quantity (likely a second bound for the same field), to the model
+        if _ALTERNATIVE_RE.search(line) or any(_is_unlabelled_threshold(c) for c in clauses):
+            continue
+        # Only numbers in the same clause as the field name are attributed to it
+        for clause in clauses:
+            fields = [f for f, field_re in _BOUND_FIELDS.items() if field_re.search(clause)]
+            # Skip clauses naming both fields (or neither), other quantities, or more than a range's
+            # worth of numbers, and fields named in several clauses: the numbers can't be
+            # attributed reliably, so the model decides
+            if len(fields) != 1 or fields[0] in bounds:
+                continue
+            if sum(1 for c in clauses if _BOUND_FIELDS[fields[0]].search(c)) > 1:
+                continue
+            clause = _BOUND_FIELDS[fields[0]].sub(" ", clause)  # Drop the name ("HbA1c" holds a digit)
+            if _OTHER_QUANTITY_RE.search(clause) or len(_NUMBER_RE.findall(clause)) > 2:
+                continue
+            lo, hi = _clause_bounds(clause)
+            if (lo is None and hi is None) or (lo is not None and hi is not None and lo > hi):
+                continue
+            bounds[fields[0]] = (lo, hi)
+            bounds["criteria"][fields[0]] = line
+    return bounds
+
+def _is_unlabelled_threshold(clause: str) -> bool:
+    if any(field_re.search(clause) for field_re in _BOUND_FIELDS.values()) or _OTHER_QUANTITY_RE.search(clause):
+        return False
+    return any(r.search(clause) for r in (_RANGE_RE, _LOWER_RE, _UPPER_RE))
+
+def _clause_bounds(clause: str) -> Tuple[Optional[float], Optional[float]]:
+    range_match = _RANGE_RE.search(clause)
+    if range_match:
+        return float(range_match.group(1)), float(range_match.group(2))
+    lower, upper = _LOWER_RE.search(clause), _UPPER_RE.search(clause)
+    return (float(lower.group(1)) if lower else None), (float(upper.group(1)) if upper else None)
+
+def _as_number(value: Any) -> Optional[float]:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if number != number else number  # NaN -> None
+
+def _rule_result(reason: str, inclusion_not_met: List[str], exclusion_met: List[str]) -> Dict[str, Any]:
+    return {
+        "decision": "INELIGIBLE",
+        "reason": reason,
+        "inclusion_criteria_met": [],
+        "inclusion_criteria_not_met": inclusion_not_met,
+        "exclusion_criteria_met": exclusion_met,
+        "exclusion_criteria_not_met": [],
+        "missing_info": [],
+    }
+
+def deterministic_exclusion(patient_data: Dict[str, Any], trial_text: str) -> Optional[Dict[str, Any]]:
+    """
+    Rule-based pre-screen that needs no model call.
+    Returns an INELIGIBLE result for a patient flagged is_pregnant when the trial's
+    exclusion criteria list pregnancy, or for an age / HbA1c outside the protocol's
+    inclusion range, otherwise None (the patient must be screened by the model).
+    Pregnancy-related diagnosis codes are left to the model: they may be historical.
+    Bounds are treated as inclusive, so borderline values are still left to the model.
+    """
+    bounds = extract_numeric_bounds(trial_text)
 
+    if "pregnancy" in bounds["exclusions"] and str(patient_data.get("is_pregnant")).lower() == "true":
+        return _rule_result(
+            "Pregnancy exclusion (deterministic rule): the patient is recorded as pregnant, which this trial excludes.",
+            [], ["Pregnancy"])
 
+    for field, label in (("age", "Age"), ("hba1c", "HbA1c")):
+        if field not in bounds:
+            continue
+        value = _as_number(patient_data.get(field))
+        if value is None:
+            continue
+        lo, hi = bounds[field]
+        if (lo is not None and value < lo) or (hi is not None and value > hi):
+            criterion = bounds["criteria"][field]
+            return _rule_result(
+                f"{label} out of range (deterministic rule): the patient's {label} is {value:g}, outside the protocol criterion \"{criterion}\".",
+                [criterion], [])
+    return None
 
+def _batch_client():
+    """Returns a google-genai client using the key passed to configure_genai."""
+    if genai_batch is None:
+        raise RuntimeError("The Batch API requires the 'google-genai' library: pip install google-genai")
+    return genai_batch.Client(api_key=_configured_key)
+
+def batch_screen_patients(patient_dicts: List[Dict[str, Any]], trial_text: str, model_name: str = "gemini-2.0-flash") -> str:
+    """
+    Submits all patients as a single Gemini Batch API job and returns the job name.
+    Each request is keyed by patient_id so results can be matched back later.
+    The call returns as soon as the job is queued; poll with get_batch_state().
+    """
+    client = _batch_client()
+    generation_config: Dict[str, Any] = {"temperature": 0.0}
+    if _supports_json_mode(model_name):
+        generation_config.update(response_mime_type="application/json", response_schema=_RESULT_SCHEMA)
+
+    with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False, encoding="utf-8") as f:
+        for i, patient in enumerate(patient_dicts):
+            line = {
+                "key": f"BATCH_{i}" if _is_blank(patient.get("patient_id")) else str(patient["patient_id"]),
+                "request": {
+                    "contents": [{"role": "user", "parts": [{"text": _build_prompt(patient, trial_text)}]}],
+                    "generation_config": generation_config,
+                },
+            }
+            f.write(json.dumps(line, separators=(",", ":"), ensure_ascii=False) + "\n")
+        jsonl_path = f.name
+
+    try:
+        uploaded = client.files.upload(
+            file=jsonl_path,
+            config={"display_name": "screening-batch", "mime_type": "jsonl"},
+        )
+    finally:
+        os.remove(jsonl_path)
+
+    job = client.batches.create(
+        model=model_name,
+        src=uploaded.name,
+        config={"display_name": "screening-batch"},
+    )
+    return job.name
+
+def get_batch_state(job_name: str) -> str:
+    """Returns the current state name of a Batch API job (e.g. JOB_STATE_RUNNING)."""
+    job = _batch_client().batches.get(name=job_name)
+    return job.state.name
+
+def collect_batch_results(job_name: str) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Downloads the output of a finished Batch API job.
+    Returns (patient_id, result) pairs; failed requests come back as ERROR results.
+    """
+    client = _batch_client()
+    job = client.batches.get(name=job_name)
+    if job.state.name != "JOB_STATE_SUCCEEDED":
+        raise RuntimeError(f"Batch job is not complete (state: {job.state.name}).")
+
+    raw = client.files.download(file=job.dest.file_name)
+    results: List[Tuple[str, Dict[str, Any]]] = []
+    for line in raw.splitlines():
+        if not line.strip():
+            continue
+        item = orjson.loads(line)
+        key = str(item.get("key", ""))
+        if "error" in item:
+            results.append((key, {"decision": "ERROR", "reason": str(item["error"]), "missing_info": []}))
+            continue
+        try:
+            parts = item["response"]["candidates"][0]["content"]["parts"]
+            text_resp = "".join(p.get("text", "") for p in parts)
+        except (KeyError, IndexError, TypeError):
+            results.append((key, {"decision": "ERROR", "reason": "Empty batch response.", "missing_info": []}))
+            continue
+        results.append((key, _parse_model_text(text_resp)))
+    return results
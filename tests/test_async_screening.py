@@ -0,0 +1,97 @@
+import asyncio
+import types
+import unittest
+from unittest import mock
+
+import screening_utils
+
+RESULT_TEXT = (
+    '{"decision": "ELIGIBLE", "reason": "ok", "inclusion_criteria_met": [], "inclusion_criteria_not_met": [],'
+    ' "exclusion_criteria_met": [], "exclusion_criteria_not_met": [], "missing_info": []}'
+)
+
+class LoopBoundModel:
+    """Stands in for a GenerativeModel whose grpc.aio channel is tied to the first loop it ran on."""
+
+    def __init__(self):
+        self.loop = None
+        self.calls = 0
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False):
+        loop = asyncio.get_running_loop()
+        if self.loop is None:
+            self.loop = loop
+        elif loop is not self.loop or self.loop.is_closed():
+            raise RuntimeError("Event loop is closed")
+        self.calls += 1
+        response = types.SimpleNamespace(text=RESULT_TEXT)
+        if not stream:
+            return response
+
+        async def chunks():
+            yield response
+
+        return chunks()
+
+class SuccessiveEventLoopsTest(unittest.TestCase):
+    def setUp(self):
+        self.model = LoopBoundModel()
+        patcher = mock.patch.object(screening_utils, "_get_model", lambda model_name: self.model)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_two_asyncio_runs_back_to_back(self):
+        for _ in range(2):
+            result = asyncio.run(screening_utils.screen_patient_async({"age": 50}, "Trial", use_cache=False))
+            self.assertEqual(result["decision"], "ELIGIBLE", result["reason"])
+        self.assertEqual(self.model.calls, 2)
+
+    def test_two_fan_outs_back_to_back(self):
+        async def fan_out():
+            sem = asyncio.Semaphore(2)
+
+            async def one(i):
+                async with sem:
+                    return await screening_utils.screen_patient_async({"age": 40 + i}, "Trial", use_cache=False)
+
+            return await asyncio.gather(*(one(i) for i in range(5)))
+
+        for _ in range(2):
+            results = asyncio.run(fan_out())
+            self.assertEqual([r["decision"] for r in results], ["ELIGIBLE"] * 5)
+        self.assertEqual(self.model.calls, 10)
+
+    def test_two_screen_cohort_calls(self):
+        for run in range(2):
+            patients = [{"age": 40 + 10 * run + i} for i in range(5)]
+            results = screening_utils.screen_cohort(patients, "Trial", concurrency=2)
+            self.assertEqual([r["decision"] for r in results], ["ELIGIBLE"] * 5)
+        self.assertEqual(self.model.calls, 10)
+
+class ReconfigureTest(unittest.TestCase):
+    def setUp(self):
+        def make_model(model_name):
+            model = LoopBoundModel()
+            model.count_tokens = mock.Mock()
+            model.count_tokens_async = mock.AsyncMock()
+            return model
+
+        for patcher in (
+            mock.patch.object(screening_utils.genai, "configure"),
+            mock.patch.object(screening_utils.genai, "GenerativeModel", make_model),
+            mock.patch.object(screening_utils, "_configured_key", None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        screening_utils._get_model.cache_clear()
+        self.addCleanup(screening_utils._get_model.cache_clear)
+
+    def test_screening_after_key_change(self):
+        for key in ("key-1", "key-2"):
+            screening_utils.configure_genai(key)
+            result = asyncio.run(screening_utils.screen_patient_async({"age": 50}, "Trial", use_cache=False))
+            self.assertEqual(result["decision"], "ELIGIBLE", result["reason"])
+        self.assertEqual(screening_utils.genai.configure.call_count, 2)
+
+if __name__ == "__main__":
+    unittest.main()
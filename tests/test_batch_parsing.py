@@ -0,0 +1,37 @@
+import json
+import unittest
+
+from screening_utils import _parse_batch_text
+
+def _entry(index, decision):
+    return {
+        "patient_index": index,
+        "decision": decision,
+        "reason": f"verdict for patient {index}",
+        "inclusion_criteria_met": [],
+        "inclusion_criteria_not_met": [],
+        "exclusion_criteria_met": [],
+        "exclusion_criteria_not_met": [],
+        "missing_info": [],
+    }
+
+def _response(*entries):
+    return json.dumps({"results": list(entries)})
+
+class ParseBatchTextTest(unittest.TestCase):
+    def test_entries_matched_on_patient_index(self):
+        text = _response(_entry(2, "INELIGIBLE"), _entry(1, "ELIGIBLE"))
+        self.assertEqual([r["decision"] for r in _parse_batch_text(text, 2)], ["ELIGIBLE", "INELIGIBLE"])
+
+    def test_zero_based_index_falls_back_to_position(self):
+        text = _response(_entry(0, "ELIGIBLE"), _entry(1, "INELIGIBLE"))
+        results = _parse_batch_text(text, 2)
+        self.assertEqual([r["decision"] for r in results], ["ELIGIBLE", "INELIGIBLE"])
+        self.assertEqual(results[0]["reason"], "verdict for patient 0")
+
+    def test_count_mismatch_is_an_error_for_the_whole_chunk(self):
+        text = _response(_entry(1, "ELIGIBLE"), _entry(3, "INELIGIBLE"))
+        self.assertEqual([r["decision"] for r in _parse_batch_text(text, 3)], ["ERROR"] * 3)
+
+if __name__ == "__main__":
+    unittest.main()
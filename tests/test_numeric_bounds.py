@@ -0,0 +1,126 @@
+import os
+import unittest
+
+from screening_utils import deterministic_exclusion, extract_numeric_bounds
+
+TRIALS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "trials")
+
+def _protocol(*inclusion_lines):
+    return "### Inclusion Criteria\n" + "".join(f"- {line}\n" for line in inclusion_lines)
+
+def _read_trial(name):
+    with open(os.path.join(TRIALS_DIR, f"{name}.md"), encoding="utf-8") as f:
+        return f.read()
+
+class ExtractNumericBoundsTest(unittest.TestCase):
+    def test_other_quantity_in_a_later_clause_is_ignored(self):
+        bounds = extract_numeric_bounds(_protocol("Age ≥ 18 years and BMI ≤ 45 kg/m²"))
+        self.assertEqual(bounds["age"], (18.0, None))
+
+    def test_duration_range_is_not_read_as_age(self):
+        bounds = extract_numeric_bounds(_protocol("Aged 18 years or older with diabetes duration of 1 to 10 years"))
+        self.assertNotIn("age", bounds)
+
+    def test_glucose_range_is_not_read_as_age(self):
+        bounds = extract_numeric_bounds(_protocol("Age > 30; fasting glucose 100-250 mg/dL"))
+        self.assertEqual(bounds["age"], (30.0, None))
+
+    def test_hba1c_in_other_units_is_skipped(self):
+        self.assertNotIn("hba1c", extract_numeric_bounds(_protocol("HbA1c 53-86 mmol/mol")))
+
+    def test_alternative_thresholds_are_left_to_the_model(self):
+        for line, field in (
+            ("Age 18-75 years, or 18-80 years if on insulin", "age"),
+            ("HbA1c 7.0-10.5% for patients on metformin; 7.5-11.0% for drug-naive patients", "hba1c"),
+            ("HbA1c ≥ 7.0% (≥ 6.5% if on insulin)", "hba1c"),
+        ):
+            with self.subTest(line=line):
+                self.assertNotIn(field, extract_numeric_bounds(_protocol(line)))
+
+    def test_two_fields_on_one_line(self):
+        bounds = extract_numeric_bounds(_protocol("Age 18-75 and HbA1c 7-10%"))
+        self.assertEqual(bounds["age"], (18.0, 75.0))
+        self.assertEqual(bounds["hba1c"], (7.0, 10.0))
+
+    def test_bundled_protocols(self):
+        expected = {
+            "DECLARE_TIMI58": {"age": (40.0, None)},
+            "NCT05928572_CGM_Initiation": {"age": (18.0, None), "hba1c": (7.0, 10.0)},
+            "NCT06864546_Glutotrack": {"age": (40.0, 70.0), "hba1c": (None, 8.5)},
+        }
+        for name, fields in expected.items():
+            with self.subTest(trial=name):
+                bounds = extract_numeric_bounds(_read_trial(name))
+                self.assertEqual({f: bounds[f] for f in ("age", "hba1c") if f in bounds}, fields)
+
+class DeterministicExclusionTest(unittest.TestCase):
+    def test_unrelated_quantities_do_not_exclude(self):
+        patient = {"patient_id": "P1", "age": 50, "hba1c": 7.5}
+        for line in (
+            "Age ≥ 18 years and BMI ≤ 45 kg/m²",
+            "Aged 18 years or older with diabetes duration of 1 to 10 years",
+            "Age > 30; fasting glucose 100-250 mg/dL",
+        ):
+            with self.subTest(line=line):
+                self.assertIsNone(deterministic_exclusion(patient, _protocol(line)))
+
+    def test_conditional_bounds_do_not_exclude(self):
+        patient = {"age": 78, "hba1c": 6.8, "insulin_user": True}
+        for line in (
+            "Age 18-75 years, or 18-80 years if on insulin",
+            "HbA1c 7.0-10.5% for patients on metformin; 7.5-11.0% for drug-naive patients",
+            "HbA1c ≥ 7.0% (≥ 6.5% if on insulin)",
+        ):
+            with self.subTest(line=line):
+                self.assertIsNone(deterministic_exclusion(patient, _protocol(line)))
+
+    def test_out_of_range_age_is_excluded(self):
+        result = deterministic_exclusion({"age": 25}, _protocol("Age > 30; fasting glucose 100-250 mg/dL"))
+        self.assertEqual(result["decision"], "INELIGIBLE")
+        self.assertEqual(result["inclusion_criteria_not_met"], ["Age > 30; fasting glucose 100-250 mg/dL"])
+
+    def test_bundled_protocols(self):
+        cases = [
+            ("DECLARE_TIMI58", {"age": 35}, "INELIGIBLE"),
+            ("DECLARE_TIMI58", {"age": 50, "hba1c": 12.0}, None),
+            ("NCT05928572_CGM_Initiation", {"age": 50, "hba1c": 11.2}, "INELIGIBLE"),
+            ("NCT05928572_CGM_Initiation", {"age": 50, "hba1c": 10.0}, None),
+            ("NCT06864546_Glutotrack", {"age": 72, "hba1c": 7.0}, "INELIGIBLE"),
+            ("NCT06864546_Glutotrack", {"age": 50, "hba1c": 8.0}, None),
+        ]
+        for name, patient, decision in cases:
+            with self.subTest(trial=name, patient=patient):
+                result = deterministic_exclusion(patient, _read_trial(name))
+                self.assertEqual(result and result["decision"], decision)
+
+class PregnancyRuleTest(unittest.TestCase):
+    def test_only_the_exclusion_section_counts(self):
+        protocol = (
+            "### Description\nOutcomes after pregnancy-related diabetes.\n\n"
+            "### Inclusion Criteria\n- History of gestational diabetes or prior pregnancy\n\n"
+            "### Exclusion Criteria\n- Type 1 diabetes\n"
+        )
+        self.assertEqual(extract_numeric_bounds(protocol)["exclusions"], [])
+        self.assertIsNone(deterministic_exclusion({"is_pregnant": True}, protocol))
+
+    def test_bundled_protocols_exclude_pregnancy(self):
+        for name in ("DECLARE_TIMI58", "NCT05928572_CGM_Initiation", "NCT06864546_Glutotrack"):
+            with self.subTest(trial=name):
+                self.assertEqual(extract_numeric_bounds(_read_trial(name))["exclusions"], ["pregnancy"])
+
+    def test_flagged_patient_is_excluded(self):
+        result = deterministic_exclusion({"age": 50, "is_pregnant": True}, _read_trial("DECLARE_TIMI58"))
+        self.assertEqual(result["exclusion_criteria_met"], ["Pregnancy"])
+
+    def test_pregnancy_codes_are_left_to_the_model(self):
+        for comorbidities in (
+            "Other specified complications of pregnancy, delivered, with or without mention of antepartum condition",
+            "Encounter for elective termination of pregnancy",
+            "12 weeks gestation of pregnancy",
+        ):
+            with self.subTest(comorbidities=comorbidities):
+                patient = {"age": 50, "comorbidities": comorbidities}
+                self.assertIsNone(deterministic_exclusion(patient, _read_trial("DECLARE_TIMI58")))
+
+if __name__ == "__main__":
+    unittest.main()
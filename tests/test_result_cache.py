@@ -0,0 +1,58 @@
+import os
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import screening_utils
+
+RESULT_TEXT = (
+    '{"decision": "ELIGIBLE", "reason": "ok", "inclusion_criteria_met": [], "inclusion_criteria_not_met": [],'
+    ' "exclusion_criteria_met": [], "exclusion_criteria_not_met": [], "missing_info": []}'
+)
+
+class CountingModel:
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        self.calls += 1
+        return types.SimpleNamespace(text=RESULT_TEXT)
+
+class ResultCacheFileTest(unittest.TestCase):
+    def setUp(self):
+        self.model = CountingModel()
+        self.path = os.path.join(tempfile.mkdtemp(), "screen_cache.jsonl")
+        for patcher in (
+            mock.patch.object(screening_utils, "_get_model", lambda model_name: self.model),
+            mock.patch.object(screening_utils, "_RESULT_CACHE", {}),
+            mock.patch.object(screening_utils, "_RESULT_CACHE_FILE", None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _restart(self):
+        """Simulates a new process: empty memory, same cache file."""
+        screening_utils._RESULT_CACHE.clear()
+        screening_utils._RESULT_CACHE_FILE = None
+        screening_utils.use_result_cache_file(self.path)
+
+    def test_results_survive_a_restart(self):
+        screening_utils.use_result_cache_file(self.path)
+        screening_utils.screen_patient({"patient_id": "P1", "age": 50}, "Trial")
+        self._restart()
+        # Same clinical data under another ID hits the same entry
+        result = screening_utils.screen_patient({"patient_id": "P2", "age": 50.0}, "Trial")
+        self.assertEqual(result["decision"], "ELIGIBLE")
+        self.assertEqual(self.model.calls, 1)
+
+    def test_force_refresh_calls_the_model_and_replaces_the_entry(self):
+        screening_utils.use_result_cache_file(self.path)
+        screening_utils.screen_patient({"age": 50}, "Trial")
+        screening_utils.screen_patient({"age": 50}, "Trial", force_refresh=True)
+        self.assertEqual(self.model.calls, 2)
+        with open(self.path, "rb") as f:
+            self.assertEqual(len(f.readlines()), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import asyncio
+import types
+import unittest
+from unittest import mock
+
+import screening_utils
+
+# A result split over several chunks, followed by text the model keeps writing after the object
+CHUNKS = [
+    '{"decision": "ELIGIBLE", "reason": "ok", "inclusion_criteria_met": [], ',
+    '"inclusion_criteria_not_met": [], "exclusion_criteria_met": [], "exclusion_criteria_not_met": [], ',
+    '"missing_info": []}',
+    "\nThe patient meets all criteria because...",
+    " further commentary.",
+]
+
+class FakeStream:
+    """Records how far a streamed response was read and whether it was closed."""
+
+    def __init__(self):
+        self.read = 0
+        self.closed = False
+
+    def chunks(self):
+        try:
+            for text in CHUNKS:
+                self.read += 1
+                yield types.SimpleNamespace(text=text)
+        finally:
+            self.closed = True
+
+    async def achunks(self):
+        try:
+            for text in CHUNKS:
+                self.read += 1
+                yield types.SimpleNamespace(text=text)
+        finally:
+            self.closed = True
+
+class FakeModel:
+    def __init__(self):
+        self.stream_flags = []
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        self.stream_flags.append(stream)
+        return FakeStream().chunks() if stream else types.SimpleNamespace(text="".join(CHUNKS[:3]))
+
+class ReadStreamTest(unittest.TestCase):
+    def test_sync_stream_is_closed_once_the_object_closes(self):
+        stream = FakeStream()
+        parsed, _ = screening_utils._read_stream(stream.chunks())
+        self.assertEqual(parsed["decision"], "ELIGIBLE")
+        self.assertTrue(stream.closed)
+        self.assertEqual(stream.read, 3)
+
+    def test_async_stream_is_closed_once_the_object_closes(self):
+        stream = FakeStream()
+        parsed, _ = asyncio.run(screening_utils._read_stream_async(stream.achunks()))
+        self.assertEqual(parsed["decision"], "ELIGIBLE")
+        self.assertTrue(stream.closed)
+        self.assertEqual(stream.read, 3)
+
+class StreamingModeTest(unittest.TestCase):
+    def setUp(self):
+        self.model = FakeModel()
+        patcher = mock.patch.object(screening_utils, "_get_model", lambda model_name: self.model)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_json_mode_models_are_not_streamed(self):
+        result = screening_utils.screen_patient({"age": 50}, "Trial", "gemini-2.0-flash", use_cache=False)
+        self.assertEqual(result["decision"], "ELIGIBLE")
+        self.assertEqual(self.model.stream_flags, [False])
+
+    def test_free_form_models_are_streamed(self):
+        result = screening_utils.screen_patient({"age": 50}, "Trial", "gemini-1.0-pro", use_cache=False)
+        self.assertEqual(result["decision"], "ELIGIBLE")
+        self.assertEqual(self.model.stream_flags, [True])
+
+if __name__ == "__main__":
+    unittest.main()